@@ -55,6 +55,14 @@ class Multithreading(StrEnum):
     SINGLE_LOGICAL = 'single_logical'
 
 
+@functools.lru_cache(maxsize=None)
+def get_visible_devices():
+    # CUDA_VISIBLE_DEVICES does not change within a process, parse it once.
+    if 'CUDA_VISIBLE_DEVICES' not in os.environ:
+        return None
+    return tuple(os.environ['CUDA_VISIBLE_DEVICES'].split(','))
+
+
 class Device:
     # assume nvml returns list of 64 bit ints
     _nvml_bit_affinity = 64
@@ -64,8 +72,8 @@ class Device:
     ) // _nvml_bit_affinity
 
     def __init__(self, device_idx):
-        if 'CUDA_VISIBLE_DEVICES' in os.environ:
-            visible_devices = os.environ['CUDA_VISIBLE_DEVICES'].split(',')
+        visible_devices = get_visible_devices()
+        if visible_devices is not None:
             if device_idx >= len(visible_devices):
                 msg = (
                     f'Requested device_idx={device_idx} is out of bounds for '
@@ -127,17 +135,18 @@ class Device:
         else:
             raise GPUAffinityError('Unknown affinity scope')
 
-        affinity_string = ''
-        for j in pynvml.nvmlDeviceGetCpuAffinityWithinScope(
-            self.handle, Device._nvml_affinity_elements, nvml_scope
+        ret = []
+        for word_idx, word in enumerate(
+            pynvml.nvmlDeviceGetCpuAffinityWithinScope(
+                self.handle, Device._nvml_affinity_elements, nvml_scope
+            )
         ):
-            # assume nvml returns list of 64 bit ints
-            affinity_string = '{:064b}'.format(j) + affinity_string
-
-        affinity_list = [int(x) for x in affinity_string]
-        affinity_list.reverse()  # so core 0 is in 0th element of list
-
-        ret = [i for i, e in enumerate(affinity_list) if e != 0]
+            # assume nvml returns list of 64 bit ints, core 0 in the lowest bit
+            base = word_idx * Device._nvml_bit_affinity
+            while word:
+                low = word & -word
+                ret.append(base + low.bit_length() - 1)
+                word ^= low
         return ret
 
 
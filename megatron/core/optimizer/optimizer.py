@@ -938,7 +938,7 @@ class Float16OptimizerWithFloat16Params(MixedPrecisionOptimizer):
                     if param.type() in ['torch.cuda.HalfTensor', 'torch.cuda.BFloat16Tensor']:
                         float16_params_this_group.append(param)
                         # Create a copy
-                        main_param = param.detach().clone().float()
+                        main_param = param.detach().float()
                         # Copy tensor model parallel attributes.
                         tensor_parallel.copy_tensor_model_parallel_attributes(main_param, param)
                         if hasattr(param, 'shared'):
@@ -1,6 +1,9 @@
 import torch
-from apex.optimizers import FusedAdam as Adam
-# from torch.optim import AdamW as Adam
+try:
+    from apex.optimizers import FusedAdam as Adam
+except ImportError:
+    # Matches the torch fallback of megatron.core.optimizer when apex is missing.
+    from torch.optim import AdamW as Adam
 
 
 def rollback_optimizer_step(optimizer):
@@ -1,6 +1,8 @@
 import contextlib
+import math
+import numpy as np
 import torch
-from collections import defaultdict
+from collections import defaultdict, deque
 from torch.autograd.graph import saved_tensors_hooks
 from enum import Enum
 import os
@@ -9,19 +11,93 @@ import uuid
 
 from megatron.core import parallel_state
 
+try:
+    import numba
+
+    HAVE_NUMBA = True
+except ImportError:
+    HAVE_NUMBA = False
+
+# Track distinct storages touched by offload and print their total size.
+DEBUG_STORAGE_STATS = False
+# Print a trace line for every saved / resumed tensor.
+_DEBUG = False
+# Saved tensors smaller than this stay on the GPU.
+_MIN_OFFLOAD_BYTES = 4096
+# Once two different views of a storage are saved, the whole storage is offloaded instead
+# if it is at most this many times the two views together.
+_WHOLE_STORAGE_FACTOR = 2
+
+_RANK = None
+_WORLD_SIZE = None
+
+
+def _get_rank():
+    global _RANK
+    if _RANK is None:
+        _RANK = torch.distributed.get_rank()
+    return _RANK
+
+
+def _get_world_size():
+    global _WORLD_SIZE
+    if _WORLD_SIZE is None:
+        _WORLD_SIZE = torch.distributed.get_world_size()
+    return _WORLD_SIZE
+
+
+def _maybe_njit(fn):
+    return numba.njit(cache=True)(fn) if HAVE_NUMBA else fn
+
+
+@_maybe_njit
+def _ffd_pack(sizes, bin_size, min_bin):
+    """First-fit-decreasing of sizes (sorted descending) into bins of capacity bin_size.
+
+    A size that fits in no bin opens a new power-of-two bin of at least min_bin.
+    Returns the bin and offset of every size, and the used length of every bin.
+    """
+    n = sizes.shape[0]
+    capacity = np.zeros(bin_size.shape[0] + n, dtype=np.int64)
+    capacity[:bin_size.shape[0]] = bin_size
+    used = np.zeros(bin_size.shape[0] + n, dtype=np.int64)
+    n_bins = bin_size.shape[0]
+    bin_idx = np.empty(n, dtype=np.int64)
+    offset = np.empty(n, dtype=np.int64)
+    for t in range(n):
+        size = sizes[t]
+        chosen = -1
+        for i in range(n_bins):
+            if used[i] + size <= capacity[i]:
+                chosen = i
+                break
+        if chosen < 0:
+            # Fragmentation left no room; open a bin just for this size.
+            cap = 1
+            while cap < size:
+                cap <<= 1
+            capacity[n_bins] = max(cap, min_bin)
+            chosen = n_bins
+            n_bins += 1
+        bin_idx[t] = chosen
+        offset[t] = used[chosen]
+        used[chosen] += size
+    return bin_idx, offset, used[:n_bins]
+
 
 def checksum(tensor):
+    # Mean of squares as a 0-dim fp32 tensor; call .item() only when the value is needed.
     with torch.no_grad():
         if tensor.dtype == torch.half:
-            return torch.mean(tensor * tensor).sum().item()
+            return torch.linalg.vector_norm(tensor, dtype=torch.float32).pow_(2).div_(tensor.numel())
         else:
-            return 0
+            return tensor.new_zeros((), dtype=torch.float32)
 
 def is_a_view(x, y):
-    return x.storage().data_ptr() == y.storage().data_ptr() and x.storage_offset() == y.storage_offset() and x.numel() == y.numel()
+    return x.untyped_storage().data_ptr() == y.untyped_storage().data_ptr() and x.storage_offset() == y.storage_offset() and x.numel() == y.numel()
 
 def tensor_info(tensor):
-    return (tensor.shape, tensor.layout, tensor.dtype, tensor.stride())
+    return (tensor.shape, tensor.layout, tensor.dtype, tensor.stride(), tensor.is_contiguous())
 
 def save_rng_states():
     from megatron.core.tensor_parallel.random import get_cuda_rng_tracker
@@ -93,9 +169,9 @@ class PairedBarrier:
         if not get_args().paired_barrier:
             return
         if peer is None:
-            peer = torch.distributed.get_rank() ^ 1
+            peer = _get_rank() ^ 1
             # Skip if peer is out of world size
-            if peer >= torch.distributed.get_world_size():
+            if peer >= _get_world_size():
                 return
 
         if cls.event is None:
@@ -130,6 +206,20 @@ class FakeActivationStore:
             PairedBarrier.wait_peer()
         return
 
+class SaveHandle:
+    """What the pack hook returns for one saved tensor; kind is an ActivationStore.SaveType value."""
+    __slots__ = ('kind', 'index', 'dtype', 'shape', 'stride', 'offset', 'payload')
+
+    def __init__(self, kind, index=None, dtype=None, shape=None, stride=None, offset=0, payload=None):
+        self.kind = kind
+        self.index = index
+        self.dtype = dtype
+        self.shape = shape
+        self.stride = stride
+        self.offset = offset
+        self.payload = payload
+
+
 class ActivationStore(saved_tensors_hooks):
     @classmethod
     def recompute_tensor(cls, tensor, parents, function, rng_states=None):
@@ -171,56 +261,112 @@ class ActivationStore(saved_tensors_hooks):
         assert not self._offloaded
         self._change_state({ActivationStore.State.NEW, ActivationStore.State.SAVING}, ActivationStore.State.SAVING)
         if isinstance(tensor, torch.nn.parameter.Parameter):
-            return ActivationStore.SaveType.PASS_THROUGH, tensor
-        if tensor.numel() <= 1024:
-            return ActivationStore.SaveType.PASS_THROUGH, tensor
+            return SaveHandle(_PASS_THROUGH, payload=tensor)
+        if tensor.numel() * tensor.element_size() < _MIN_OFFLOAD_BYTES:
+            # Copy launch overhead outweighs the memory saved for tiny tensors.
+            return SaveHandle(_PASS_THROUGH, payload=tensor)
 
         recompute = partial_recompute._save_tensor(tensor)
         if recompute[0] == PartialRecompute.RecomputeSaveType.RECOMPUTE:
             (parents, function, rng_states) = recompute[1]
             parent_handles = [self._save_tensor(x) for x in parents]
-            return ActivationStore.SaveType.RECOMPUTE, (parent_handles, function, rng_states)
+            return SaveHandle(_RECOMPUTE, payload=(parent_handles, function, rng_states))
     
-        for index, stored_tensor in enumerate(self._gpu_store):
-            if is_a_view(tensor, stored_tensor):
-                offset = tensor.storage_offset() - stored_tensor.storage_offset()
-                stride = tensor.stride()
-                shape = tensor.shape
-                return ActivationStore.SaveType.ALIAS, (tensor.dtype, index, shape, stride, offset)
-
-        self._gpu_store.append(tensor.data)
-        if (len(self._offload_tensor_info) < len(self._gpu_store)):
-            self._offload_tensor_info.append(tensor_info(tensor))
+        storage = tensor.untyped_storage()
+        ptr = storage.data_ptr()
+        dtype = tensor.dtype
+        storage_offset = tensor.storage_offset()
+        numel = tensor.numel()
+        # Any tensor on a storage that was saved whole is an alias into it.
+        index = self._storage_index.get((ptr, dtype))
+        if index is not None:
+            return self._alias(index, tensor)
+        # Same key as is_a_view, so a hit is exactly a view of a stored tensor.
+        key = (ptr, storage_offset, numel)
+        index = self._storage_index.get(key)
+        if index is not None:
+            return self._alias(index, tensor)
+
+        # A second, different view of a storage (e.g. k after q out of one qkv) turns the
+        # first view's slot into the whole storage, so later views become aliases instead
+        # of separate copies. Small views into large buffers are still saved on their own.
+        first = self._first_view.get((ptr, dtype))
+        if first is not None:
+            storage_numel = storage.nbytes() // tensor.element_size()
+            if storage_numel <= _WHOLE_STORAGE_FACTOR * (math.prod(first.shape) + numel):
+                index = first.index
+                self._gpu_store[index] = tensor.data.as_strided((storage_numel,), (1,), 0)
+                self._slot_offset[index] = 0
+                first.kind = _ALIAS
+                self._storage_index[(ptr, dtype)] = index
+                return self._alias(index, tensor)
+
+        index = self._save_idx
+        self._save_idx += 1
+        if index < len(self._gpu_store):
+            self._gpu_store[index] = tensor.data
+            self._slot_refs[index] = 1
+            self._slot_offset[index] = storage_offset
         else:
-            assert(self._offload_tensor_info[len(self._gpu_store) - 1] == tensor_info(tensor))
-        self._save_event.record()
-        # print(f"rank {torch.distributed.get_rank()} Saving tensor id {len(self._gpu_store) - 1} {id(tensor)} {tensor.shape}, dtype {tensor.dtype}, device {tensor.device} storage {tensor.storage().data_ptr()}")
-        return (ActivationStore.SaveType.OFFLOAD, len(self._gpu_store) - 1)
+            # Only the first microbatch grows the store; later ones reuse the slots.
+            self._gpu_store.append(tensor.data)
+            self._slot_refs.append(1)
+            self._slot_offset.append(storage_offset)
+        self._storage_index[key] = index
+        if _DEBUG:
+            print(f"rank {_get_rank()} Saving tensor id {index} {id(tensor)} {tensor.shape}, dtype {tensor.dtype}, device {tensor.device} storage {tensor.untyped_storage().data_ptr()}")
+        # Shape, stride and offset are kept in case the slot is promoted to the whole storage.
+        handle = SaveHandle(_OFFLOAD, index, dtype, tensor.shape, tensor.stride(), storage_offset)
+        if first is None:
+            self._first_view[(ptr, dtype)] = handle
+        return handle
+
+    def _alias(self, index, tensor):
+        self._slot_refs[index] += 1
+        return SaveHandle(_ALIAS, index, tensor.dtype, tensor.shape, tensor.stride(), tensor.storage_offset())
     
-    def _resume_tensor(self, packed, remove_used=True):
+    def _resume_tensor(self, handle, remove_used=True):
         assert not self._offloaded
-        type, info = packed
         self._change_state({ActivationStore.State.RESUMED, ActivationStore.State.RESUME_USED}, ActivationStore.State.RESUME_USED)
-        if type == ActivationStore.SaveType.PASS_THROUGH:
-            return info
-        if type == ActivationStore.SaveType.RECOMPUTE:
-            p_infos, function, rng_states = info
-            parents = [self._resume_tensor(x, remove_used=False) for x in p_infos]
-            return partial_recompute._resume_tensor((PartialRecompute.RecomputeSaveType.RECOMPUTE, (parents, function, rng_states)))
-        if packed[0] == ActivationStore.SaveType.ALIAS:
-            dtype, index, shape, stride, offset = packed[1]
-            self._resume_event.wait()
-            # print(f"rank {torch.distributed.get_rank()} Resuming alias tensor id {index} {shape}, offset {offset}")
-            bin, o = self.index_offset[index]
-            return torch.as_strided(self._continuous_gpu_buffer[dtype][bin], shape, stride, o + offset)
-        assert type == ActivationStore.SaveType.OFFLOAD
-        self._resume_event.wait()
-        index = info
+        return ActivationStore._RESUMERS[handle.kind](self, handle, remove_used)
+
+    def _resume_pass_through(self, handle, remove_used):
+        return handle.payload
+
+    def _resume_recompute(self, handle, remove_used):
+        p_infos, function, rng_states = handle.payload
+        parents = [self._resume_tensor(x, remove_used=False) for x in p_infos]
+        return partial_recompute._resume_tensor((PartialRecompute.RecomputeSaveType.RECOMPUTE, (parents, function, rng_states)))
+
+    def _resume_alias(self, handle, remove_used):
+        index = handle.index
+        bin, o = self.index_offset[index]
+        self._bin_resume_events[handle.dtype][bin].wait()
+        if _DEBUG:
+            print(f"rank {_get_rank()} Resuming alias tensor id {index} {handle.shape}, offset {handle.offset}")
+        ret = torch.as_strided(self._continuous_gpu_buffer[handle.dtype][bin], handle.shape, handle.stride,
+                               o + handle.offset - self._slot_offset[index])
+        self._release_slot(index, remove_used)
+        return ret
+
+    def _resume_offload(self, handle, remove_used):
+        index = handle.index
+        self._bin_resume_events[self._offload_tensor_info[index][2]][self.index_offset[index][0]].wait()
         ret = self._gpu_store[index]
+        self._release_slot(index, remove_used)
+        if _DEBUG:
+            print(f"rank {_get_rank()} Resuming tensor id {index} {ret.shape}, dtype {ret.dtype}, device {ret.device}")
+        return ret
+
+    def _release_slot(self, index, remove_used):
+        # A slot is freed once every handle into it has been resumed.
+        self._slot_refs[index] -= 1
+        if self._slot_refs[index] > 0:
+            return
         self._gpu_store[index] = None
         if remove_used:
-            shape, layout, dtype, stride = self._offload_tensor_info[index]
-            bin, offset = self.index_offset[index]
+            dtype = self._offload_tensor_info[index][2]
+            bin = self.index_offset[index][0]
             all_freed = True
             for (i, (b, o)) in enumerate(self.index_offset):
                 if self._gpu_store[i] is not None and b == bin and self._offload_tensor_info[i][2] == dtype:
@@ -228,11 +374,19 @@ class ActivationStore(saved_tensors_hooks):
                     break
             if all_freed:
                 self._continuous_gpu_buffer[dtype][bin] = None
-        # print(f"rank {torch.distributed.get_rank()} Resuming tensor id {index} {ret.shape}, dtype {ret.dtype}, device {ret.device}")
-        return ret
 
     def __init__(self, h2d_stream=None, d2h_stream=None):
         self._gpu_store=[]
+        # Number of tensors stored in _gpu_store during the current SAVING phase
+        self._save_idx = 0
+        # (storage ptr, storage offset, numel) or, for whole storages, (storage ptr, dtype)
+        # -> index in _gpu_store, for alias lookup while saving
+        self._storage_index = {}
+        # (storage ptr, dtype) -> handle of the first tensor saved from that storage
+        self._first_view = {}
+        # Per slot in _gpu_store: handles not yet resumed, and the storage offset it starts at
+        self._slot_refs = []
+        self._slot_offset = []
         self._offloaded = False
         self._save_event = torch.cuda.Event()
         self._prepare_resume_event = torch.cuda.Event()
@@ -244,108 +398,129 @@ class ActivationStore(saved_tensors_hooks):
         # Datastructures for offload
         self._continuous_cpu_buffer = None
         self._continuous_gpu_buffer = None
+        # Resume bins lent by the pool for --offload-persistent-gpu-buffers, None otherwise
+        self._pool_resume_bins = None
         self._offload_tensor_info = []
         self._index_offset = []
         self._index_cpu_buffer = []
+        # Bins in the order resume copies them, and the event marking each bin's arrival.
+        self._resume_order = []
+        self._bin_resume_events = None
+        # Events of D2H copies still in flight, oldest first.
+        self._inflight = deque()
 
         self._state = ActivationStore.State.NEW
         super().__init__(self._save_tensor, self._resume_tensor)
         
-    def _allocate_cpu_buffers(self):
+    def _allocate_buffers(self):
         if self._continuous_cpu_buffer is not None:
             return
         alignment=64
         
         
-        def size_of_tensor(shape, stride):
-            id_stride = list(sorted([(i, s) for i, s in enumerate(stride) if shape[i] != 1], key=lambda x: x[1]))
-            size = 1
-            for i, st in id_stride:
-                assert size == st, f"stride {stride} size {shape} not continuous"
-                size *= shape[i]
+        def size_of_tensor(shape, stride, is_contig):
+            size = math.prod(shape)
+            if not is_contig:
+                # Permuted but dense layouts are fine, the buffer only needs to be gap-free.
+                id_stride = list(sorted([(i, s) for i, s in enumerate(stride) if shape[i] != 1], key=lambda x: x[1]))
+                dense_size = 1
+                for i, st in id_stride:
+                    assert dense_size == st, f"stride {stride} size {shape} not continuous"
+                    dense_size *= shape[i]
             return (size + (alignment - 1)) // alignment * alignment
 
         self.index_offset = []
 
-        # dtype -> (size, id)
-        type_tensors=defaultdict(list)
+        # dtype -> sizes, dtype -> ids, as parallel columns
+        type_sizes=defaultdict(list)
+        type_ids=defaultdict(list)
 
-        for id, (shape, layout, dtype, stride) in enumerate(self._offload_tensor_info):
+        for id, (shape, layout, dtype, stride, is_contig) in enumerate(self._offload_tensor_info):
             assert layout == torch.strided
             # assert dtype == torch.half, f"Only half precision supported, got {dtype} shape {shape}"
-            mysize = size_of_tensor(shape, stride)
-            type_tensors[dtype].append((mysize, id))
+            type_sizes[dtype].append(size_of_tensor(shape, stride, is_contig))
+            type_ids[dtype].append(id)
 
         def nearest_power_of_2(x):
             return 2**(x-1).bit_length()
 
-        def allocate_offset(tensors, max_split=4):
-            total_size = sum([x[0] for x in tensors])
-            aligned_size = nearest_power_of_2(total_size)
-            bin_size = [aligned_size // 2**i for i in range(max_split)]
-            bins = [0] * max_split
-            tensors = sorted(tensors, key=lambda x: x[0], reverse=True)
-            while True:
-                bins[-1] += bin_size[-1]
-                for i in range(max_split - 1, 0, -1):
-                    if bins[i] > bin_size[i]:
-                        bins[i] = 0
-                        bins[i-1] += bin_size[i-1]
-
-                solution_bins = [x for x in bins if x > 0]
-                # print(solution_bins)
-                if sum(solution_bins) < total_size:
-                    continue
-                current_bin = [0] * len(solution_bins)
-                # id -> (bin, offset)
-                solution = {}
-                fit = True
-                for size, id in tensors:
-                    ok=False
-                    for i in range(len(solution_bins)):
-                        if current_bin[i] + size <= solution_bins[i]:
-                            current_bin[i] += size
-                            solution[id] = (i, current_bin[i] - size)
-                            ok=True
-                            break
-                    if not ok:
-                        fit = False
-                        break
-                if fit:
-                    assert len(solution) == len(tensors)
-                    assert all([x > 0 for x in current_bin])
-                    return current_bin, solution
+        def allocate_offset(sizes, ids, max_split=4):
+            # First-fit-decreasing into power-of-two bins no larger than the
+            # largest tensor's bin and no smaller than 1/2**(max_split-1) of it.
+            order = np.argsort(-sizes, kind='stable')
+            sizes, ids = sizes[order], ids[order].tolist()
+            total_size = int(sizes.sum())
+            max_bin = nearest_power_of_2(int(sizes[0]))
+            min_bin = max(max_bin >> (max_split - 1), 1)
+            bin_size = []
+            while sum(bin_size) < total_size:
+                remaining = total_size - sum(bin_size)
+                bin_size.append(max(min(max_bin, nearest_power_of_2(remaining)), min_bin))
+
+            bin_idx, offsets, current_bin = _ffd_pack(sizes, np.asarray(bin_size, dtype=np.int64), min_bin)
+            current_bin = current_bin.tolist()
+            # id -> (bin, offset)
+            solution = {id: (b, o) for id, b, o in zip(ids, bin_idx.tolist(), offsets.tolist())}
+
+            # Drop bins FFD left empty and renumber the rest.
+            used = [i for i in range(len(current_bin)) if current_bin[i] > 0]
+            renumber = {old: new for new, old in enumerate(used)}
+            solution = {id: (renumber[b], o) for id, (b, o) in solution.items()}
+            current_bin = [current_bin[i] for i in used]
+            assert len(solution) == len(ids)
+            return current_bin, solution
         
         import psutil
-        print(f"rank {torch.distributed.get_rank()} before allocation rss {psutil.Process(os.getpid()).memory_info().rss / 1000000} MB")
+        print(f"rank {_get_rank()} before allocation rss {psutil.Process(os.getpid()).memory_info().rss / 1000000} MB")
         self._continuous_cpu_buffer = {}
         self.index_offset = [None] * len(self._offload_tensor_info)
-        for (dtype, tensors) in type_tensors.items():
+        for dtype in type_sizes:
             from megatron.training import get_args
             if get_args().offload_continuous_buffers:
-                bins, solution = allocate_offset(tensors, max_split=8)
+                bins, solution = allocate_offset(
+                    np.asarray(type_sizes[dtype], dtype=np.int64), np.asarray(type_ids[dtype], dtype=np.int32), max_split=8)
             else:
-                bins = [t[0] for t in tensors]
-                solution = {tensors[i][1]: (i, 0) for i in range(len(tensors))}
+                bins = type_sizes[dtype]
+                solution = {id: (i, 0) for i, id in enumerate(type_ids[dtype])}
 
             self._continuous_cpu_buffer[dtype] = [
                 torch.empty([size], dtype=dtype, pin_memory=True, device='cpu') for size in bins]
             for id, (bin, offset) in solution.items():
                 self.index_offset[id] = (bin, offset)
-            print(f"rank {torch.distributed.get_rank()} after allocation {dtype} {bins} elements rss {psutil.Process(os.getpid()).memory_info().rss / 1000000} MB")
+            print(f"rank {_get_rank()} after allocation {dtype} {bins} elements rss {psutil.Process(os.getpid()).memory_info().rss / 1000000} MB")
 
         # Print stats
-        for dtype, tensors in type_tensors.items():
-            total_size = sum([x[0] for x in tensors])
+        for dtype, sizes in type_sizes.items():
+            total_size = sum(sizes)
             allocated_size = sum([x.numel() for x in self._continuous_cpu_buffer[dtype]])
             aligned_size  = sum([nearest_power_of_2(x.numel()) for x in self._continuous_cpu_buffer[dtype]])
-            print(f"rank {torch.distributed.get_rank()} Allocated {allocated_size / 1000000} M elements for {len(tensors)} tensors of type {dtype} total length {total_size} aligned size {aligned_size}")
+            print(f"rank {_get_rank()} Allocated {allocated_size / 1000000} M elements for {len(sizes)} tensors of type {dtype} total length {total_size} aligned size {aligned_size}")
         
 
-        for index, (shape, layout, dtype, stride) in enumerate(self._offload_tensor_info):
+        # Backward consumes activations roughly in reverse save order, so resume
+        # the bin holding the most recently saved tensor first.
+        last_saved = {}
+        for index, (shape, layout, dtype, stride, is_contig) in enumerate(self._offload_tensor_info):
             bin, offset = self.index_offset[index]
             ctensor = torch.as_strided(self._continuous_cpu_buffer[dtype][bin], shape, stride, offset)
             self._index_cpu_buffer.append(ctensor)
+            last_saved[(dtype, bin)] = index
+        self._resume_order = sorted(last_saved, key=lambda x: last_saved[x], reverse=True)
+        self._bin_resume_events = {
+            dtype: [torch.cuda.Event() for _ in bins] for dtype, bins in self._continuous_cpu_buffer.items()}
+
+    def _offload_copy(self, dst, src, max_inflight):
+        # Bound the number of outstanding D2H copies so the copy engine is not flooded.
+        # This blocks the calling (schedule) thread until the oldest copy finishes, so
+        # no more GPU work is issued from this rank while waiting.
+        if max_inflight is not None:
+            while len(self._inflight) >= max_inflight:
+                self._inflight.popleft().synchronize()
+        dst.copy_(src, non_blocking=True)
+        if max_inflight is not None:
+            event = torch.cuda.Event()
+            event.record()
+            self._inflight.append(event)
 
     @torch.no_grad()
     @torch.cuda.nvtx.range("Offload")
@@ -357,26 +532,40 @@ class ActivationStore(saved_tensors_hooks):
         storage_size=0
         storages = set()
         
+        from megatron.training import get_args
+        max_inflight = get_args().offload_max_inflight_copies
+        self._inflight.clear()
+        # Recorded here rather than while saving, as a slot may since hold its whole storage.
+        for index in range(self._save_idx):
+            info = tensor_info(self._gpu_store[index])
+            if len(self._offload_tensor_info) <= index:
+                self._offload_tensor_info.append(info)
+            else:
+                assert(self._offload_tensor_info[index] == info)
+        # One record on the producer stream covers every save issued so far.
+        self._save_event.record()
         with torch.cuda.stream(self._d2h_stream) if self._d2h_stream else contextlib.nullcontext():
             self._save_event.wait()
-            self._allocate_cpu_buffers()
+            self._allocate_buffers()
+            assert self._save_idx == len(self._offload_tensor_info)
             PairedBarrier.wait_peer()
-            for index, tensor in enumerate(self._gpu_store):
+            for index in range(self._save_idx):
+                tensor = self._gpu_store[index]
                 buffer = self._index_cpu_buffer[index]
                 assert buffer.shape == tensor.shape
-                buffer.copy_(tensor, non_blocking=True)
-                size+=tensor.numel()
-                if tensor.storage().data_ptr() not in storages:
-                    # print(f"rank {torch.distributed.get_rank()} Storage of tensor {tensor.shape} size {tensor.storage().size()/1000000} MB not in set")
-                    storages.add(tensor.storage().data_ptr())
-                    storage_size+=tensor.storage().nbytes()
-                else:
-                    # print(f"rank {torch.distributed.get_rank()} Storage of tensor {tensor.shape} size {tensor.storage().size()/1000000} MB already in set")
-                    pass
+                self._offload_copy(buffer, tensor, max_inflight)
+                if DEBUG_STORAGE_STATS:
+                    size+=tensor.numel()
+                    storage = tensor.untyped_storage()
+                    ptr = storage.data_ptr()
+                    if ptr not in storages:
+                        storages.add(ptr)
+                        storage_size+=storage.nbytes()
                 # print(f"Saving buffer to cpu shape {buffer.shape}, dtype {buffer.dtype}, device {buffer.device}")
             PairedBarrier.record()
             self._offload_complete_event.record()
-        # print(f"rank {torch.distributed.get_rank()} Offloaded {size / 1000000000} Billion elements, {len(self._gpu_store)} tensors, storage size {storage_size / 1000000000} GBytes")
+        if DEBUG_STORAGE_STATS:
+            print(f"rank {_get_rank()} Offloaded {size / 1000000000} Billion elements, {self._save_idx} tensors, storage size {storage_size / 1000000000} GBytes")
         
         self._offloaded = True
 
@@ -387,19 +576,28 @@ class ActivationStore(saved_tensors_hooks):
         assert self._offloaded
         if self._d2h_stream is not None:
             self._offload_complete_event.wait()
-        self._gpu_store.clear()
+        for index in range(len(self._gpu_store)):
+            self._gpu_store[index] = None
+        self._save_idx = 0
+        self._storage_index.clear()
+        self._first_view.clear()
 
     @torch.no_grad()
     @torch.cuda.nvtx.range("PrepareResume")
-    def prepare_resume(self):
+    def prepare_resume(self, resume_bins=None):
         self._change_state(ActivationStore.State.OFFLOAD_RELEASED, ActivationStore.State.RESUME_PREPARED)
         assert self._offloaded
-        self._continuous_gpu_buffer = {
-            dtype: [torch.empty_like(x, device='cuda') for x in bins] for dtype, bins in self._continuous_cpu_buffer.items()}
-        for index, (shape, layout, dtype, stride) in enumerate(self._offload_tensor_info):
+        if resume_bins is not None:
+            # Bins are dropped from this dict as they are consumed; the lent ones stay allocated.
+            self._pool_resume_bins = resume_bins
+            self._continuous_gpu_buffer = {dtype: list(bins) for dtype, bins in resume_bins.items()}
+        else:
+            self._continuous_gpu_buffer = {
+                dtype: [torch.empty_like(x, device='cuda') for x in bins] for dtype, bins in self._continuous_cpu_buffer.items()}
+        for index, (shape, layout, dtype, stride, is_contig) in enumerate(self._offload_tensor_info):
             bin, offset = self.index_offset[index]
             gtensor = torch.as_strided(self._continuous_gpu_buffer[dtype][bin], shape, stride, offset)
-            self._gpu_store.append(gtensor)
+            self._gpu_store[index] = gtensor
         
         self._prepare_resume_event.record()
 
@@ -414,9 +612,9 @@ class ActivationStore(saved_tensors_hooks):
             self._prepare_resume_event.wait()
             self._offload_complete_event.wait()
             PairedBarrier.wait_peer()
-            for dtype, bins in self._continuous_cpu_buffer.items():
-                for (cpu, gpu) in zip(bins, self._continuous_gpu_buffer[dtype]):
-                    gpu.copy_(cpu, non_blocking=True)
+            for dtype, bin in self._resume_order:
+                self._continuous_gpu_buffer[dtype][bin].copy_(self._continuous_cpu_buffer[dtype][bin], non_blocking=True)
+                self._bin_resume_events[dtype][bin].record()
             PairedBarrier.record()
             self._resume_event.record()
         self._offloaded = False
@@ -429,12 +627,25 @@ class ActivationStore(saved_tensors_hooks):
         assert all([all([x is None for x in y]) for y in self._continuous_gpu_buffer.values()])
         self._resume_event.wait()
         
-        self._gpu_store.clear()
         self._continuous_gpu_buffer.clear()
 
     def reset_state(self):
         self._change_state(ActivationStore.State.RESUME_RELEASED, ActivationStore.State.NEW)
 
+_OFFLOAD = ActivationStore.SaveType.OFFLOAD.value
+_PASS_THROUGH = ActivationStore.SaveType.PASS_THROUGH.value
+_RECOMPUTE = ActivationStore.SaveType.RECOMPUTE.value
+_ALIAS = ActivationStore.SaveType.ALIAS.value
+
+# Indexed by SaveHandle.kind.
+ActivationStore._RESUMERS = (
+    None,
+    ActivationStore._resume_offload,
+    ActivationStore._resume_pass_through,
+    ActivationStore._resume_recompute,
+    ActivationStore._resume_alias,
+)
+
 offload_stream = None
 d2h_stream = None
 def get_offload_h2d_stream():
@@ -462,6 +673,9 @@ class ActivationStorePool:
     def __init__(self) -> None:
         self._pool = []
         self._stage_queues = [[] for x in range (6)]
+        # CPU bin layout -> idle sets of persistent GPU resume bins. Only stores between
+        # prepare_resume and resume_release hold a set, so that bounds how many exist.
+        self._idle_resume_bins = defaultdict(list)
     
     def get_for_offload(self) -> ActivationStore:
         if self._pool:
@@ -485,15 +699,39 @@ class ActivationStorePool:
     def offload_release(self):
         return self.pop_call_push(1, lambda x: x.offload_release())
     
+    def _resume_bin_layout(self, store):
+        return tuple((dtype, tuple(x.numel() for x in bins)) for dtype, bins in store._continuous_cpu_buffer.items())
+
+    def _acquire_resume_bins(self, store):
+        from megatron.training import get_args
+        if not get_args().offload_persistent_gpu_buffers:
+            return None
+        idle = self._idle_resume_bins[self._resume_bin_layout(store)]
+        if idle:
+            return idle.pop()
+        return {dtype: [torch.empty_like(x, device='cuda') for x in bins] for dtype, bins in store._continuous_cpu_buffer.items()}
+
     def prepare_resume(self):
-        return self.pop_call_push(2, lambda x: x.prepare_resume())
+        return self.pop_call_push(2, lambda x: x.prepare_resume(self._acquire_resume_bins(x)))
     
     def resume(self):
-        return self.pop_call_push(3, lambda x: x.resume())
+        from megatron.training import get_args
+        depth = get_args().offload_prefetch_depth
+        ret = self.pop_call_push(3, lambda x: x.resume() if x._state != ActivationStore.State.RESUMED else None)
+        # Start H2D for the next prepared stores too, so their copies are already
+        # in flight when the schedule reaches them.
+        for store in self._stage_queues[3][:depth - 1]:
+            if store._state == ActivationStore.State.RESUME_PREPARED:
+                store.resume()
+        return ret
     
     def resume_release(self, store_deprecated = None):
         self.pop_call_push(4, lambda x: x.resume_release())
-        self._pool.append(self._stage_queues[5].pop(0))
+        store = self._stage_queues[5].pop(0)
+        if store._pool_resume_bins is not None:
+            self._idle_resume_bins[self._resume_bin_layout(store)].append(store._pool_resume_bins)
+            store._pool_resume_bins = None
+        self._pool.append(store)
 
     def is_empty(self):
         return sum([len(x) for x in self._stage_queues]) == 0
@@ -1,6 +1,9 @@
 import contextlib
-import copy
+import functools
 import itertools
+import math
+import pickle
+from collections import deque
 from dataclasses import dataclass
 from typing import Iterator, Tuple, List, Union, Callable, Any, Optional
 
@@ -39,12 +42,12 @@ from megatron.training.training import RollbackDataIteratorWrapper
 from megatron.training.utils import is_second_last_pipeline_stage
 
 
-AUTO_SCHEDULE_COMMUNICATION_TYPES = {
+AUTO_SCHEDULE_COMMUNICATION_TYPES = frozenset({
     FuncType.RECV_FORWARD,
     FuncType.RECV_BACKWARD,
     FuncType.SEND_FORWARD,
     FuncType.SEND_BACKWARD,
-}
+})
 
 
 @dataclass
@@ -69,10 +72,11 @@ class TrainingIterationConfig:
 
 class SpQueue:
     """A queue of a stack"""
+    __slots__ = ('ready_queue', 'tmp_stack', 'num_seq_splits')
 
     def __init__(self, num_seq_splits):
         # Using two queues for safety of abusing.
-        self.ready_queue = []
+        self.ready_queue = deque()
         self.tmp_stack = []
         self.num_seq_splits = num_seq_splits
 
@@ -84,9 +88,10 @@ class SpQueue:
 
     def pop(self):
         assert self.ready_queue
-        ret = self.ready_queue[0].pop(-1)
-        if not self.ready_queue[0]:
-            self.ready_queue.pop(0)
+        top = self.ready_queue[0]
+        ret = top.pop()
+        if not top:
+            self.ready_queue.popleft()
         return ret
 
 
@@ -111,33 +116,64 @@ class ActivationPoolCache:
         assert all_empty
 
 
+def _dispatch_node(schedule_func):
+    def handler(self, it, node, next_is_comm, next_compute, non_w_pending):
+        schedule_func(self, node)
+    return handler
+
+
+def _dispatch_ignore(self, it, node, next_is_comm, next_compute, non_w_pending):
+    pass
+
+
+def _dispatch_unknown(self, it, node, next_is_comm, next_compute, non_w_pending):
+    raise ValueError(f"Unknown node type {node.type}")
+
+
 class TrainingIteration:
     class Buffers:
+        __slots__ = (
+            'input_tensors', 'output_tensors', 'total_num_tokens',
+            'send_forward_buffer', 'recv_forward_buffer', 'send_backward_buffer', 'recv_backward_buffer',
+            'forward_data_store', 'local_send_forward_buffer', 'local_send_backward_buffer',
+        )
+
         def __init__(self):
             # two dim array, first dim is the model chunk, second dim is the microbatch queue
             num_chunks = get_virtual_pipeline_number()
-            self.input_tensors = [SpQueue(get_args().num_seq_splits) for _ in range(num_chunks)]
-            self.output_tensors = [SpQueue(get_args().num_seq_splits) for _ in range(num_chunks)]
+            num_seq_splits = get_args().num_seq_splits
+
+            def chunk_seq_buffer():
+                return [[[] for _ in range(num_seq_splits)] for _ in range(num_chunks)]
+
+            self.input_tensors = [SpQueue(num_seq_splits) for _ in range(num_chunks)]
+            self.output_tensors = [SpQueue(num_seq_splits) for _ in range(num_chunks)]
             self.total_num_tokens = torch.tensor(0, dtype=torch.int).cuda()
-            chunk_buf = [[] for _ in range(get_args().num_seq_splits)]
-            buf = [copy.deepcopy(chunk_buf) for _ in range(num_chunks)]
-            self.send_forward_buffer = copy.deepcopy(buf)
-            self.recv_forward_buffer = copy.deepcopy(buf)
-            self.send_backward_buffer = copy.deepcopy(buf)
-            self.recv_backward_buffer = copy.deepcopy(buf)
+            self.send_forward_buffer = chunk_seq_buffer()
+            self.recv_forward_buffer = chunk_seq_buffer()
+            self.send_backward_buffer = chunk_seq_buffer()
+            self.recv_backward_buffer = chunk_seq_buffer()
             self.forward_data_store = []
-            self.local_send_forward_buffer = [[] for _ in range(get_args().num_seq_splits)]
-            self.local_send_backward_buffer = [[] for _ in range(get_args().num_seq_splits)]
+            self.local_send_forward_buffer = [[] for _ in range(num_seq_splits)]
+            self.local_send_backward_buffer = [[] for _ in range(num_seq_splits)]
 
         def buffer_map(self, node: ScheduledNode):
-            return {
-                FuncType.SEND_FORWARD: self.send_forward_buffer[node.chunk][node.seq_split_idx],
-                FuncType.RECV_FORWARD: self.recv_forward_buffer[node.chunk][node.seq_split_idx],
-                FuncType.SEND_BACKWARD: self.send_backward_buffer[node.chunk][node.seq_split_idx],
-                FuncType.RECV_BACKWARD: self.recv_backward_buffer[node.chunk][node.seq_split_idx],
-            }[node.type]
+            node_type = node.type
+            if node_type is FuncType.SEND_FORWARD:
+                buffers = self.send_forward_buffer
+            elif node_type is FuncType.RECV_FORWARD:
+                buffers = self.recv_forward_buffer
+            elif node_type is FuncType.SEND_BACKWARD:
+                buffers = self.send_backward_buffer
+            elif node_type is FuncType.RECV_BACKWARD:
+                buffers = self.recv_backward_buffer
+            else:
+                raise KeyError(node_type)
+            return buffers[node.chunk][node.seq_split_idx]
 
     class States:
+        __slots__ = ('w_clear_run', 'communication_batch', 'it', 'save_act_ctxs', 'resume_act_ctxs')
+
         def __init__(self):
             num_chunks = get_virtual_pipeline_number()
             self.w_clear_run = [False] * num_chunks
@@ -169,6 +205,16 @@ class TrainingIteration:
         self.buffers = TrainingIteration.Buffers()
         self.iteration_id = iteration_id
         self.activation_pool_cache = activation_pool_cache
+        # Constant for the whole run, snapshot them to keep the lookups off the schedule loop.
+        self._args = get_args()
+        self._num_chunks = get_virtual_pipeline_number()
+        self._multi_chunks = self._num_chunks > 1
+        self._profile = self._args.profile
+        self._profile_mem_iter = self._args.profile_memory_iter
+        self._do_mem_profile = self._profile_mem_iter >= 0
+        # (device, dtype, is recv) => tiny buffer for pre_communication_optimization handshakes
+        self._pre_comm_tensors = {}
+        self._dispatch_table = self._build_dispatch_table()
 
     def update_config(
         self, iteration_config,
@@ -177,6 +223,28 @@ class TrainingIteration:
         The config will be updated on each run of the iteration.
         """
         self.iteration_config = iteration_config
+        self._dispatch_table = self._build_dispatch_table()
+
+    def _build_dispatch_table(self):
+        """
+        Resolve the handler and the look-ahead info of every node in one reverse pass,
+        so that run() does not scan the rest of the schedule for each node.
+        """
+        schedules = self.iteration_config.schedules
+        table = [None] * len(schedules)
+        next_is_comm, next_compute, non_w_pending = False, None, False
+        for i in range(len(schedules) - 1, -1, -1):
+            node = schedules[i]
+            handler = self._DISPATCH.get(node.type, _dispatch_unknown)
+            table[i] = (handler, node, next_is_comm, next_compute, non_w_pending)
+            next_is_comm = node.type in AUTO_SCHEDULE_COMMUNICATION_TYPES
+            if next_is_comm:
+                node.direction_key = self.direction_map(node)
+            if node.type.is_computation():
+                next_compute = node
+            if node.type is not W:
+                non_w_pending = True
+        return table
 
     def reset(self):
         self.states = TrainingIteration.States()
@@ -188,67 +256,39 @@ class TrainingIteration:
     def run(self):
         it = self.states.it
         conf = self.iteration_config
-        multi_chunks = get_virtual_pipeline_number() > 1
+        multi_chunks = self._multi_chunks
         bufs = self.buffers
 
         WeightGradStore.assert_empty()
         self.disable_grad_sync()
 
-        rank = parallel_state.get_pipeline_model_parallel_rank()
-        if get_args().profile_memory_iter >= 0:
+        # Memory profiling is off in the common case, decide everything here once.
+        record_memory_history = self._do_mem_profile and self.iteration_id == self._profile_mem_iter
+        if self._do_mem_profile:
+            rank = parallel_state.get_pipeline_model_parallel_rank()
             max_allocated = torch.cuda.max_memory_allocated() // 1000000
             current_allocated = torch.cuda.memory_allocated() // 1000000
             print(f"MEMORY: rank {rank} iteration {self.iteration_id} max_allocated: {max_allocated} current_allocated: {current_allocated}")
-        if self.iteration_id == get_args().profile_memory_iter:
+        if record_memory_history:
             torch.cuda.memory._record_memory_history()
 
-        if get_args().profile:
+        if self._profile:
             torch.cuda.nvtx.range_push(f'iter_{torch.distributed.get_rank()}_{ScheduleTimers.iter_counter}')
 
-        while it < len(conf.schedules):
-            scheduled_node = conf.schedules[it]
-
-            if multi_chunks:
-                parallel_state.set_virtual_pipeline_model_parallel_rank(scheduled_node.chunk)
-            if scheduled_node.type.is_post_validation_related():
-                # Ignore post validation nodes.
-                pass
-            elif scheduled_node.type in AUTO_SCHEDULE_COMMUNICATION_TYPES:
-                next_is_comm = it + 1 < len(conf.schedules) and conf.schedules[
-                    it + 1].type in AUTO_SCHEDULE_COMMUNICATION_TYPES
-                next_compute = list(filter(lambda x: x.type.is_computation(), conf.schedules[it + 1:]))
-                next_compute = next_compute[0] if len(next_compute) > 0 else None
-                self.add_communication(scheduled_node, next_is_comm, next_compute)
-            elif scheduled_node.type == FuncType.OFFLOAD_SEND_START:
-                self.schedule_offload_send_start(scheduled_node)
-            elif scheduled_node.type == FuncType.OFFLOAD_SEND_END:
-                self.schedule_offload_send_end(scheduled_node)
-            elif scheduled_node.type == FuncType.OFFLOAD_RECV_PREP:
-                self.schedule_offload_recv_prepare(scheduled_node)
-            elif scheduled_node.type == FuncType.OFFLOAD_RECV_START:
-                self.pre_load_batch(it)
-                self.schedule_offload_recv_start(scheduled_node)
-            elif scheduled_node.type == FuncType.OFFLOAD_RECV_END:
-                self.schedule_offload_recv_end(scheduled_node)
-            elif scheduled_node.type == FuncType.OFFLOAD_BARRIER:
-                self.schedule_offload_barrier(scheduled_node)
-            elif scheduled_node.type == F:
-                self.schedule_f(scheduled_node)
-            elif scheduled_node.type == B:
-                self.schedule_b(scheduled_node)
-            elif scheduled_node.type == BW:
-                self.schedule_bw(scheduled_node)
-            elif scheduled_node.type == W:
-                non_w_pending = any([node.type != W for node in conf.schedules[it + 1:]])
-                self.schedule_w(scheduled_node, non_w_pending)
-            elif scheduled_node.type == R:
-                self.schedule_r(scheduled_node)
-            else:
-                raise ValueError(f"Unknown node type {scheduled_node.type}")
+        dispatch_table = self._dispatch_table
+        # Consecutive nodes mostly share a chunk, only update the virtual rank when it changes.
+        # Handlers that switch chunks internally (pre_load_batch) restore it before returning.
+        vp_rank = None
+        while it < len(dispatch_table):
+            handler, scheduled_node, next_is_comm, next_compute, non_w_pending = dispatch_table[it]
+            if multi_chunks and scheduled_node.chunk != vp_rank:
+                vp_rank = scheduled_node.chunk
+                parallel_state.set_virtual_pipeline_model_parallel_rank(vp_rank)
+            handler(self, it, scheduled_node, next_is_comm, next_compute, non_w_pending)
             it += 1
         self.states.it = it
 
-        if get_args().profile:
+        if self._profile:
             torch.cuda.nvtx.range_pop()  # iter
         if self.iteration_id == 0:
             torch.cuda.empty_cache()
@@ -266,10 +306,10 @@ class TrainingIteration:
                     conf.model, bufs.total_num_tokens if conf.config.calculate_per_token_loss else None
                 )
 
-            if get_args().zero_bubble_pipeline_timers_end_iter == ScheduleTimers.iter_counter:
+            if self._args.zero_bubble_pipeline_timers_end_iter == ScheduleTimers.iter_counter:
                 ScheduleTimers.concluded = True
 
-        if self.iteration_id == get_args().profile_memory_iter:
+        if record_memory_history:
             torch.cuda.memory._dump_snapshot(f"mem-profile-rank{rank}")
 
         WeightGradStore.assert_empty()
@@ -279,8 +319,8 @@ class TrainingIteration:
 
     def run_until_post_validation(self, optimizer):
         conf = self.iteration_config
-        num_chunks = get_virtual_pipeline_number()
-        multi_chunks = get_virtual_pipeline_number() > 1
+        num_chunks = self._num_chunks
+        multi_chunks = self._multi_chunks
 
         updated, grad_norm, rollback, succeed = None, None, None, None
         it = self.states.it
@@ -293,24 +333,24 @@ class TrainingIteration:
                 data_iter.clear_buffer()
                 data_iter.save_to_buffer()
 
+            vp_rank = None
             while it < len(conf.schedules):
                 scheduled_node = conf.schedules[it]
-                if multi_chunks:
-                    parallel_state.set_virtual_pipeline_model_parallel_rank(scheduled_node.chunk)
-                if scheduled_node.type in [FuncType.SEND_FORWARD, FuncType.RECV_FORWARD]:
+                if multi_chunks and scheduled_node.chunk != vp_rank:
+                    vp_rank = scheduled_node.chunk
+                    parallel_state.set_virtual_pipeline_model_parallel_rank(vp_rank)
+                if scheduled_node.type in (FuncType.SEND_FORWARD, FuncType.RECV_FORWARD):
                     assert scheduled_node.chunk % num_chunks == 0
-                    next_is_comm = it + 1 < len(conf.schedules) and conf.schedules[it + 1].type in AUTO_SCHEDULE_COMMUNICATION_TYPES
-                    next_compute = list(filter(lambda x: x.type.is_computation(), conf.schedules[it + 1:]))
-                    next_compute = next_compute[0] if len(next_compute) > 0 else None
+                    _, _, next_is_comm, next_compute, _ = self._dispatch_table[it]
                     self.add_communication(scheduled_node, next_is_comm, next_compute)
-                elif scheduled_node.type == F:
+                elif scheduled_node.type is F:
                     assert scheduled_node.chunk % num_chunks == 0
                     self.schedule_f(scheduled_node)
-                elif scheduled_node.type == FuncType.RECV_POST_VALIDATION:
+                elif scheduled_node.type is FuncType.RECV_POST_VALIDATION:
                     optimizer.recv_post_validation()
-                elif scheduled_node.type == FuncType.SEND_POST_VALIDATION:
+                elif scheduled_node.type is FuncType.SEND_POST_VALIDATION:
                     optimizer.send_post_validation()
-                elif scheduled_node.type == FuncType.POST_VALIDATION:
+                elif scheduled_node.type is FuncType.POST_VALIDATION:
                     self.flush()
                     updated, grad_norm, rollback, succeed = optimizer.post_validation(self._free_buffers)
                     break
@@ -319,21 +359,21 @@ class TrainingIteration:
                 it += 1
             assert succeed is not None
         else:
+            vp_rank = None
             while it < len(conf.schedules):
                 scheduled_node = conf.schedules[it]
-                if multi_chunks:
-                    parallel_state.set_virtual_pipeline_model_parallel_rank(scheduled_node.chunk)
-                if scheduled_node.type in [FuncType.SEND_FORWARD, FuncType.RECV_FORWARD, F]:
-                    if optimizer.do_prev_step and scheduled_node.type == FuncType.RECV_FORWARD:
-                        next_is_comm = it + 1 < len(conf.schedules) and conf.schedules[it + 1].type in AUTO_SCHEDULE_COMMUNICATION_TYPES
-                        next_compute = list(filter(lambda x: x.type.is_computation(), conf.schedules[it + 1:]))
-                        next_compute = next_compute[0] if len(next_compute) > 0 else None
+                if multi_chunks and scheduled_node.chunk != vp_rank:
+                    vp_rank = scheduled_node.chunk
+                    parallel_state.set_virtual_pipeline_model_parallel_rank(vp_rank)
+                if scheduled_node.type in (FuncType.SEND_FORWARD, FuncType.RECV_FORWARD, F):
+                    if optimizer.do_prev_step and scheduled_node.type is FuncType.RECV_FORWARD:
+                        _, _, next_is_comm, next_compute, _ = self._dispatch_table[it]
                         self.add_communication(scheduled_node, next_is_comm, next_compute)
-                elif scheduled_node.type == FuncType.RECV_POST_VALIDATION:
+                elif scheduled_node.type is FuncType.RECV_POST_VALIDATION:
                     optimizer.recv_post_validation()
-                elif scheduled_node.type == FuncType.SEND_POST_VALIDATION:
+                elif scheduled_node.type is FuncType.SEND_POST_VALIDATION:
                     optimizer.send_post_validation()
-                elif scheduled_node.type == FuncType.POST_VALIDATION:
+                elif scheduled_node.type is FuncType.POST_VALIDATION:
                     self.flush()
                     updated, grad_norm, rollback, succeed = optimizer.post_validation(self._free_buffers)
                     break
@@ -348,7 +388,7 @@ class TrainingIteration:
                     scheduled_node = conf.schedules[it]
                     if multi_chunks:
                         parallel_state.set_virtual_pipeline_model_parallel_rank(scheduled_node.chunk)
-                    if scheduled_node.type == FuncType.RECV_FORWARD and scheduled_node.rollback:
+                    if scheduled_node.type is FuncType.RECV_FORWARD and scheduled_node.rollback:
                         self.add_communication(scheduled_node, False, None)
                     it += 1
             self.reset()
@@ -369,36 +409,36 @@ class TrainingIteration:
         return save_act
 
     def schedule_offload_barrier(self, scheduled_node: ScheduledNode):
-        if get_args().cpu_offload:
+        if self._args.cpu_offload:
             FakeActivationStore.barrier()
 
     def schedule_offload_send_start(self, scheduled_node: ScheduledNode):
-        if get_args().cpu_offload:
+        if self._args.cpu_offload:
             activation_store_pool = self.activation_pool_cache.get_activation_store(scheduled_node)
             activation_store_pool.offload()
 
     def schedule_offload_send_end(self, scheduled_node: ScheduledNode):
-        if get_args().cpu_offload:
+        if self._args.cpu_offload:
             activation_store_pool = self.activation_pool_cache.get_activation_store(scheduled_node)
             activation_store_pool.offload_release()
 
     def schedule_offload_recv_prepare(self, scheduled_node: ScheduledNode):
-        if get_args().cpu_offload:
+        if self._args.cpu_offload:
             activation_store_pool = self.activation_pool_cache.get_activation_store(scheduled_node)
             activation_store_pool.prepare_resume()
 
     def schedule_offload_recv_start(self, scheduled_node: ScheduledNode):
-        if get_args().cpu_offload:
+        if self._args.cpu_offload:
             activation_store_pool = self.activation_pool_cache.get_activation_store(scheduled_node)
             activation_store_pool.resume()
 
     def schedule_offload_recv_end(self, scheduled_node: ScheduledNode):
-        if get_args().cpu_offload:
+        if self._args.cpu_offload:
             activation_store_pool = self.activation_pool_cache.get_activation_store(scheduled_node)
             activation_store_pool.resume_release()
 
     def schedule_f(self, scheduled_node: ScheduledNode):
-        if get_args().cpu_offload and scheduled_node.should_offload:
+        if self._args.cpu_offload and scheduled_node.should_offload:
             save_act = self.prepare_offload(scheduled_node)
         else:
             save_act = partial_recompute
@@ -413,9 +453,9 @@ class TrainingIteration:
             RecomputeStore.flush()
 
     def pre_load_batch(self, idx):
-        offload_time = get_args().offload_time
+        offload_time = self._args.offload_time
         cnt = (int(offload_time) + 1) * 3
-        multi_chunks = get_virtual_pipeline_number() > 1
+        multi_chunks = self._multi_chunks
         conf = self.iteration_config
         from pretrain_gpt import DataLoaderStore
         count = len(DataLoaderStore.cache)
@@ -423,7 +463,7 @@ class TrainingIteration:
             if idx + 1 + i >= len(conf.schedules):
                 continue
             node = conf.schedules[idx + 1 + i]
-            if node.type != F:
+            if node.type is not F:
                 continue
             if count > 0:
                 count -= 1
@@ -440,11 +480,11 @@ class TrainingIteration:
 
     def load_all_batch(self):
         conf = self.iteration_config
-        multi_chunks = get_virtual_pipeline_number() > 1
+        multi_chunks = self._multi_chunks
         from pretrain_gpt import DataLoaderStore
         assert len(DataLoaderStore.cache) == 0
         for scheduled_node in conf.schedules:
-            if scheduled_node.type != F:
+            if scheduled_node.type is not F:
                 continue
             if multi_chunks:
                 parallel_state.set_virtual_pipeline_model_parallel_rank(scheduled_node.chunk)
@@ -455,7 +495,7 @@ class TrainingIteration:
 
     def schedule_f_impl(self, scheduled_node: ScheduledNode):
         conf = self.iteration_config
-        multi_chunks = get_virtual_pipeline_number() > 1
+        multi_chunks = self._multi_chunks
         bufs = self.buffers
 
         if parallel_state.is_pipeline_first_stage():
@@ -468,18 +508,18 @@ class TrainingIteration:
             input_tensor = bufs.local_send_forward_buffer[scheduled_node.seq_split_idx].pop(0)
         else:
             input_tensor, handles = bufs.recv_forward_buffer[scheduled_node.chunk][scheduled_node.seq_split_idx].pop(0)
-            for h in handles:
-                h.wait()
+            wait_handles(handles)
         assert isinstance(input_tensor, list), "input_tensor should be list of tensors"
 
-        if get_args().profile:
+        if self._profile:
             torch.cuda.nvtx.range_push(
                 f'F{scheduled_node.microbatch}.{scheduled_node.chunk}.{scheduled_node.seq_split_idx}')
 
         if conf.run_timer:
             ScheduleTimers.for_chunk(scheduled_node.chunk).f_cnt += 1
             ScheduleTimers.for_chunk(scheduled_node.chunk).f.start()
-            mem_before = torch.cuda.memory_allocated()
+            if ScheduleTimers.track_mem:
+                mem_before = torch.cuda.memory_allocated()
 
         parallel_state.set_seq_split_idx(scheduled_node.seq_split_idx)
         from pretrain_gpt import DataLoaderStore
@@ -502,8 +542,9 @@ class TrainingIteration:
 
         if conf.run_timer:
             ScheduleTimers.for_chunk(scheduled_node.chunk).f.stop()
-            ScheduleTimers.for_chunk(scheduled_node.chunk).f_mem += torch.cuda.memory_allocated() - mem_before
-        if get_args().profile:
+            if ScheduleTimers.track_mem:
+                ScheduleTimers.for_chunk(scheduled_node.chunk).f_mem += torch.cuda.memory_allocated() - mem_before
+        if self._profile:
             torch.cuda.nvtx.range_pop()
 
         if not parallel_state.is_pipeline_last_stage():
@@ -532,7 +573,7 @@ class TrainingIteration:
 
     def schedule_b_impl(self, scheduled_node: ScheduledNode):
         conf = self.iteration_config
-        multi_chunks = get_virtual_pipeline_number() > 1
+        multi_chunks = self._multi_chunks
         if conf.forward_only:
             return
 
@@ -555,17 +596,17 @@ class TrainingIteration:
         else:
             output_tensor_grad, handles = bufs.recv_backward_buffer[
                 scheduled_node.chunk][scheduled_node.seq_split_idx].pop(0)
-            for h in handles:
-                h.wait()
+            wait_handles(handles)
         assert isinstance(output_tensor_grad, list), "output_tensor_grad should be a list"
 
-        if get_args().profile:
+        if self._profile:
             torch.cuda.nvtx.range_push(
                 f'B{scheduled_node.microbatch}.{scheduled_node.chunk}.{scheduled_node.seq_split_idx}')
         if conf.run_timer:
             ScheduleTimers.for_chunk(scheduled_node.chunk).b_cnt += 1
             ScheduleTimers.for_chunk(scheduled_node.chunk).b.start()
-            mem_before = torch.cuda.memory_allocated()
+            if ScheduleTimers.track_mem:
+                mem_before = torch.cuda.memory_allocated()
 
         def resume_input_tensor(input_tensor):
             for t in input_tensor:
@@ -584,8 +625,9 @@ class TrainingIteration:
 
         if conf.run_timer:
             ScheduleTimers.for_chunk(scheduled_node.chunk).b.stop()
-            ScheduleTimers.for_chunk(scheduled_node.chunk).b_mem += torch.cuda.memory_allocated() - mem_before
-        if get_args().profile:
+            if ScheduleTimers.track_mem:
+                ScheduleTimers.for_chunk(scheduled_node.chunk).b_mem += torch.cuda.memory_allocated() - mem_before
+        if self._profile:
             torch.cuda.nvtx.range_pop()
 
         # No need to propagate gradient from the first layer.
@@ -611,7 +653,7 @@ class TrainingIteration:
 
     def schedule_w(self, scheduled_node, non_w_pending):
         conf = self.iteration_config
-        multi_chunks = get_virtual_pipeline_number() > 1
+        multi_chunks = self._multi_chunks
         if conf.forward_only:
             return
         chunk = scheduled_node.chunk
@@ -619,7 +661,7 @@ class TrainingIteration:
 
         if (not multi_chunks and non_w_pending) or \
                 (multi_chunks and non_w_pending and scheduled_node.microbatch != conf.num_microbatches - 1):
-            if get_args().profile:
+            if self._profile:
                 torch.cuda.nvtx.range_push(f'W{scheduled_node.microbatch}.{scheduled_node.chunk}.{scheduled_node.seq_split_idx}')
             if conf.run_timer:
                 ScheduleTimers.for_chunk(scheduled_node.chunk).w_cnt += 1
@@ -627,12 +669,12 @@ class TrainingIteration:
             WeightGradStore.pop(chunk=scheduled_node.chunk, seq_split_idx=scheduled_node.seq_split_idx)
             if conf.run_timer:
                 ScheduleTimers.for_chunk(scheduled_node.chunk).w.stop()
-            if get_args().profile:
+            if self._profile:
                 torch.cuda.nvtx.range_pop()
         elif not states.w_clear_run[chunk]:
             # Clear if this is the last minibatch or there is no non-W pending
             pending_ws = WeightGradStore.queue_size(chunk, scheduled_node.seq_split_idx)
-            if get_args().profile:
+            if self._profile:
                 torch.cuda.nvtx.range_push(f'W_clear.{chunk}.{scheduled_node.seq_split_idx}')
             if conf.run_timer:
                 ScheduleTimers.for_chunk(scheduled_node.chunk).w_cnt += pending_ws
@@ -640,7 +682,7 @@ class TrainingIteration:
             WeightGradStore.clear(conf.model[chunk], chunk=chunk, seq_split_idx=scheduled_node.seq_split_idx)
             if conf.run_timer:
                 ScheduleTimers.for_chunk(scheduled_node.chunk).w.stop()
-            if get_args().profile:
+            if self._profile:
                 torch.cuda.nvtx.range_pop()  # W
             states.w_clear_run[chunk] = True
 
@@ -648,7 +690,7 @@ class TrainingIteration:
         conf = self.iteration_config
         if conf.forward_only:
             return
-        if get_args().profile:
+        if self._profile:
             torch.cuda.nvtx.range_push(
                 f'R{scheduled_node.microbatch}.{scheduled_node.chunk}.{scheduled_node.seq_split_idx}')
         # TODO: add timer for recompute
@@ -658,7 +700,7 @@ class TrainingIteration:
         RecomputeStore.pop()
         # if conf.run_timer:
         #     ScheduleTimers.for_chunk(scheduled_node.chunk).w.stop()
-        if get_args().profile:
+        if self._profile:
             torch.cuda.nvtx.range_pop()
 
     def add_communication(
@@ -672,15 +714,17 @@ class TrainingIteration:
 
         if conf.forward_only and scheduled_node.type.is_backward_comm():
             return
-        states.communication_batch[self.direction_map(scheduled_node)].append(
+        # Nodes of the schedule carry the key resolved in _build_dispatch_table.
+        direction = getattr(scheduled_node, 'direction_key', None) or self.direction_map(scheduled_node)
+        states.communication_batch[direction].append(
             (scheduled_node, conf.tensor_shape))
         def is_consumer(scheduled_node, next_compute):
             if scheduled_node.chunk == next_compute.chunk \
                     and scheduled_node.seq_split_idx == next_compute.seq_split_idx \
                     and scheduled_node.microbatch == next_compute.microbatch:
-                if scheduled_node.type == FuncType.RECV_FORWARD and next_compute.type == F:
+                if scheduled_node.type is FuncType.RECV_FORWARD and next_compute.type is F:
                     return True
-                if scheduled_node.type == FuncType.RECV_BACKWARD and next_compute.type in (B, BW):
+                if scheduled_node.type is FuncType.RECV_BACKWARD and next_compute.type in (B, BW):
                     return True
             return False
         if (next_compute is not None and is_consumer(scheduled_node, next_compute)) or not next_is_comm or conf.forward_only:
@@ -690,11 +734,7 @@ class TrainingIteration:
         conf = self.iteration_config
         states = self.states
         bufs = self.buffers
-        assert conf.send_tensor_shapes == conf.recv_tensor_shapes
-        assert len(conf.send_tensor_shapes) == 1
-        assert conf.send_tensor_shapes[0] == conf.tensor_shape
-
-        enable_pre_comm = get_args().pre_communication_optimization
+        enable_pre_comm = self._args.pre_communication_optimization
 
         sn_nodes = [x[0] for x in states.communication_batch['SEND_NEXT']]
         sp_nodes = [x[0] for x in states.communication_batch['SEND_PREV']]
@@ -703,65 +743,51 @@ class TrainingIteration:
 
         sn_tensors = [bufs.buffer_map(n).pop(0)[0] for n in sn_nodes]
         sp_tensors = [bufs.buffer_map(n).pop(0)[0] for n in sp_nodes]
+        device = torch.cuda.current_device()
+        dtype = conf.config.pipeline_dtype
         rn_tensors = [
             torch.empty(
                 conf.tensor_shape,
                 requires_grad=True,
-                device=torch.cuda.current_device(),
-                dtype=conf.config.pipeline_dtype,
+                device=device,
+                dtype=dtype,
             ) for _ in rn_nodes
         ]
-        assert conf.recv_tensor_shapes[0] == conf.tensor_shape
         rp_tensors = [
             torch.empty(
                 conf.tensor_shape,
                 requires_grad=True,
-                device=torch.cuda.current_device(),
-                dtype=conf.config.pipeline_dtype,
+                device=device,
+                dtype=dtype,
             ) for _ in rp_nodes
         ]
 
         batch_p2p = conf.config.batch_p2p_comm
         if enable_pre_comm:
-            tiny_shape = [1]
+            # The handshake payload is never read, so pre-sends share one buffer per dtype
+            # and pre-recvs another; a recv never writes into a buffer a send is reading.
             assert len(sn_tensors) == len(states.communication_batch['SEND_NEXT'])
-            pre_sn_tensors = [torch.empty(
-                tiny_shape,
-                device=t.device,
-                dtype=t.dtype,
-            ) for t in sn_tensors]
+            pre_sn_tensors = [self._pre_comm_tensor(t, recv=False) for t in sn_tensors]
             assert len(sp_tensors) == len(states.communication_batch['SEND_PREV'])
-            pre_sp_tensors = [torch.empty(
-                tiny_shape,
-                device=t.device,
-                dtype=t.dtype,
-            ) for t in sp_tensors]
+            pre_sp_tensors = [self._pre_comm_tensor(t, recv=False) for t in sp_tensors]
             assert len(rn_tensors) == len(states.communication_batch['RECV_NEXT'])
-            pre_rn_tensors = [torch.empty(
-                tiny_shape,
-                device=t.device,
-                dtype=t.dtype,
-            ) for t in rn_tensors]
+            pre_rn_tensors = [self._pre_comm_tensor(t, recv=True) for t in rn_tensors]
             assert len(rp_tensors) == len(states.communication_batch['RECV_PREV'])
-            pre_rp_tensors = [torch.empty(
-                tiny_shape,
-                device=t.device,
-                dtype=t.dtype,
-            ) for t in rp_tensors]
+            pre_rp_tensors = [self._pre_comm_tensor(t, recv=True) for t in rp_tensors]
 
             send_fused_name = '_'.join(
-                [f'{n.type}.{n.microbatch}.{n.chunk}.{n.seq_split_idx}' for n in
-                 sum([sn_nodes, sp_nodes], [])])
+                [n.nvtx_tag for n in
+                 sum([sn_nodes, sp_nodes], [])]) if self._profile else ''
 
             # Cannot fuse "pre_send" with other send kernels, or they will get stuck
             # possibly as there will be 2 send-recv with the same source and target.
-            with nvtx_range_ctx("pre_send"):
+            with nvtx_range_ctx("pre_send", self._profile):
                 pre_send, _ = multi_pipeline_ops(
                     pre_sp_tensors, [],
                     pre_sn_tensors, [],
                     batch_p2p,
                 )
-            with nvtx_range_ctx(send_fused_name):
+            with nvtx_range_ctx(send_fused_name, self._profile):
                 send_reqs, _ = multi_pipeline_ops(
                     sp_tensors, [],
                     sn_tensors, [],
@@ -771,27 +797,28 @@ class TrainingIteration:
             assert len(rp_tensors) == len(rp_nodes)
             rp_reqs = []
             for pt, t, n in zip(pre_rp_tensors, rp_tensors, rp_nodes):
-                with nvtx_range_ctx("pre_recv"):
+                with nvtx_range_ctx("pre_recv", self._profile):
                     multi_pipeline_ops([], [pt], [], [], batch_p2p)
-                recv_name = f'{n.type}.{n.microbatch}.{n.chunk}.{n.seq_split_idx}'
-                with nvtx_range_ctx(recv_name):
+                recv_name = n.nvtx_tag if self._profile else ''
+                with nvtx_range_ctx(recv_name, self._profile):
                     recv_req, _ = multi_pipeline_ops([], [t], [], [], batch_p2p)
                     assert len(recv_req) == 1
                 rp_reqs.append(recv_req[0])
 
             rn_reqs = []
             for pt, t, n in zip(pre_rn_tensors, rn_tensors, rn_nodes):
-                with nvtx_range_ctx("pre_recv"):
+                with nvtx_range_ctx("pre_recv", self._profile):
                     multi_pipeline_ops([], [], [], [pt], batch_p2p)
-                recv_name = f'{n.type}.{n.microbatch}.{n.chunk}.{n.seq_split_idx}'
-                with nvtx_range_ctx(recv_name):
+                recv_name = n.nvtx_tag if self._profile else ''
+                with nvtx_range_ctx(recv_name, self._profile):
                     recv_req, _ = multi_pipeline_ops([], [], [], [t], batch_p2p)
                     assert len(recv_req) == 1
                 rn_reqs.append(recv_req[0])
         else:
             name = '_'.join(
-                [f'{v[0].type}.{v[0].microbatch}.{v[0].chunk}.{v[0].seq_split_idx}' for v in itertools.chain(*[vs for k, vs in states.communication_batch.items()])])
-            with nvtx_range_ctx(name):
+                [v[0].nvtx_tag for v in itertools.chain(*[vs for k, vs in states.communication_batch.items()])]) \
+                if self._profile else ''
+            with nvtx_range_ctx(name, self._profile):
                 _, (sp_reqs, rp_reqs, sn_reqs, rn_reqs) = multi_pipeline_ops(
                     sp_tensors,
                     rp_tensors,
@@ -803,33 +830,41 @@ class TrainingIteration:
                 send_reqs = list(set(sp_reqs + sn_reqs))
 
         # We don't care about the reqs order here, all users need to all reqs to finish
+        # Receivers completed by the same handle (fused_pipeline_ops) share one handle list,
+        # so only the first consumer waits on it.
+        shared_handles = {}
         assert len(rn_reqs) == len(rn_nodes), f"Invalid rn_reqs {len(rn_reqs)} != {len(rn_nodes)}"
         for i, n in enumerate(rn_nodes):
             r = rn_reqs[i]
             assert not isinstance(r, list)
-            bufs.buffer_map(n).append(([rn_tensors.pop(0)], [r]))
+            bufs.buffer_map(n).append(([rn_tensors.pop(0)], shared_handles.setdefault(id(r), [r])))
         assert len(rp_reqs) == len(rp_nodes), f"Invalid rn_reqs {len(rp_reqs)} != {len(rp_nodes)}"
         for i, n in enumerate(rp_nodes):
             r = rp_reqs[i]
             assert not isinstance(r, list)
-            bufs.buffer_map(n).append(([rp_tensors.pop(0)], [r]))
+            bufs.buffer_map(n).append(([rp_tensors.pop(0)], shared_handles.setdefault(id(r), [r])))
         # send handles (send_reqs) can simply be dropped, which can save memory.
         assert(not rn_tensors)
         assert(not rp_tensors)
         for direction in ['SEND_PREV', 'SEND_NEXT']:
             for idx, x in enumerate(states.communication_batch[direction]):
-                if x[0].type == FuncType.SEND_FORWARD:
+                if x[0].type is FuncType.SEND_FORWARD:
                     deallocate_output_tensor(sp_tensors[idx] if direction == 'SEND_PREV' else sn_tensors[idx],
                                              conf.config.deallocate_pipeline_outputs)
         for k, v in states.communication_batch.items():
             v.clear()
 
+    def _pre_comm_tensor(self, t, recv):
+        key = (t.device, t.dtype, recv)
+        tensor = self._pre_comm_tensors.get(key)
+        if tensor is None:
+            tensor = torch.empty([1], device=t.device, dtype=t.dtype)
+            self._pre_comm_tensors[key] = tensor
+        return tensor
+
     @classmethod
     def direction_map(cls, node):
-        sr = "SEND_" if node.type.is_send() else "RECV_"
-        d = "NEXT" if node.comm_direction == CommDirection.NEXT else "PREV"
-        direction = sr + d
-        return direction
+        return _DIRECTION_KEYS[node.type.is_send(), node.comm_direction is CommDirection.NEXT]
 
     def disable_grad_sync(self):
         """Disable asynchronous grad reductions"""
@@ -843,6 +878,36 @@ class TrainingIteration:
             self.no_sync_context.__exit__(None, None, None)
             self.no_sync_context = None
 
+    def _dispatch_communication(self, it, node, next_is_comm, next_compute, non_w_pending):
+        self.add_communication(node, next_is_comm, next_compute)
+
+    def _dispatch_offload_recv_start(self, it, node, next_is_comm, next_compute, non_w_pending):
+        self.pre_load_batch(it)
+        self.schedule_offload_recv_start(node)
+
+    def _dispatch_w(self, it, node, next_is_comm, next_compute, non_w_pending):
+        self.schedule_w(node, non_w_pending)
+
+    # Handlers take (self, it, node, next_is_comm, next_compute, non_w_pending).
+    _DISPATCH = {
+        # Post validation nodes are ignored here.
+        FuncType.POST_VALIDATION: _dispatch_ignore,
+        FuncType.SEND_POST_VALIDATION: _dispatch_ignore,
+        FuncType.RECV_POST_VALIDATION: _dispatch_ignore,
+        **dict.fromkeys(AUTO_SCHEDULE_COMMUNICATION_TYPES, _dispatch_communication),
+        FuncType.OFFLOAD_SEND_START: _dispatch_node(schedule_offload_send_start),
+        FuncType.OFFLOAD_SEND_END: _dispatch_node(schedule_offload_send_end),
+        FuncType.OFFLOAD_RECV_PREP: _dispatch_node(schedule_offload_recv_prepare),
+        FuncType.OFFLOAD_RECV_START: _dispatch_offload_recv_start,
+        FuncType.OFFLOAD_RECV_END: _dispatch_node(schedule_offload_recv_end),
+        FuncType.OFFLOAD_BARRIER: _dispatch_node(schedule_offload_barrier),
+        F: _dispatch_node(schedule_f),
+        B: _dispatch_node(schedule_b),
+        BW: _dispatch_node(schedule_bw),
+        W: _dispatch_w,
+        R: _dispatch_node(schedule_r),
+    }
+
 
 class SchedNodeRuntime:
     def __init__(self):
@@ -851,6 +916,8 @@ class SchedNodeRuntime:
 
         self.iteration_id = 0
         self.activation_pool_cache = ActivationPoolCache()
+        # (shape, dtype, batch_p2p, sequence_parallel) already bootstrapped and profiled
+        self.bootstrapped_p2p = set()
 
         self.curr_iteration: Optional[TrainingIteration] = None
         self.next_iteration: Optional[TrainingIteration] = None
@@ -952,6 +1019,9 @@ class SchedNodeRuntime:
             encoder_decoder_xattn=encoder_decoder_xattn,
         )
         assert send_tensor_shapes[0] == tensor_shape
+        # flush() sends and receives a single tensor_shape buffer per node.
+        assert send_tensor_shapes == recv_tensor_shapes
+        assert len(send_tensor_shapes) == 1
 
         if not forward_only:
             ScheduleTimers.iter_counter += 1
@@ -961,7 +1031,11 @@ class SchedNodeRuntime:
             >= get_args().zero_bubble_pipeline_timers_start_iter
         )
 
-        bootstrap_and_profile_p2p_communication(config, [tensor_shape], [tensor_shape])
+        # Every rank prepares in the same order, so the skip is consistent across the pipeline.
+        bootstrap_key = (tensor_shape, config.pipeline_dtype, config.batch_p2p_comm, config.sequence_parallel)
+        if bootstrap_key not in self.bootstrapped_p2p:
+            if bootstrap_and_profile_p2p_communication(config, [tensor_shape], [tensor_shape]):
+                self.bootstrapped_p2p.add(bootstrap_key)
 
         iteration_config = TrainingIterationConfig(
             run_timer=run_timer,
@@ -1026,19 +1100,39 @@ class SchedNodeRuntime:
         return result
 
 
+def wait_handles(handles: List):
+    """
+    Wait on the recv handles of a node and empty the list. Lists shared between nodes
+    are then skipped by later consumers, which run on the same stream and are already
+    ordered after the wait.
+    """
+    for h in handles:
+        h.wait()
+    handles.clear()
+
+
 def get_virtual_pipeline_number():
     return parallel_state.get_virtual_pipeline_model_parallel_world_size() or 1
 
 
-@contextlib.contextmanager
-def nvtx_range_ctx(name):
-    if get_args().profile:
-        torch.cuda.nvtx.range_push(name)
-    try:
-        yield
-    finally:
-        if get_args().profile:
-            torch.cuda.nvtx.range_pop()
+_DIRECTION_KEYS = {
+    (True, True): "SEND_NEXT",
+    (True, False): "SEND_PREV",
+    (False, True): "RECV_NEXT",
+    (False, False): "RECV_PREV",
+}
+
+
+_NULL_CONTEXT = contextlib.nullcontext()
+
+
+def nvtx_range_ctx(name, enabled=None):
+    """NVTX range around a block. Callers on the hot path pass their cached profile flag."""
+    if enabled is None:
+        enabled = get_args().profile
+    if not enabled:
+        return _NULL_CONTEXT
+    return torch.cuda.nvtx.range(name)
 
 
 def p2p_pipeline_ops(
@@ -1275,6 +1369,8 @@ def bootstrap_and_profile_p2p_communication(config, send_tensor_shapes, recv_ten
         torch.distributed.all_reduce(per_communication, torch.distributed.ReduceOp.MAX)
         ScheduleTimers.comm_time = per_communication.item()
         print_rank_0(f"Communication time: {ScheduleTimers.comm_time}")
+        return True
+    return False
 
 
 shed_node_runtime = None
@@ -1291,20 +1387,67 @@ schedule_cache = None
 is_auto_schedule = False
 
 
+def _gather_schedule_arguments(f, b, w, f_mem, b_mem, w_mem, mem_limit):
+    """All-gathers the per-chunk profiling results as one packed float64 tensor.
+
+    Every rank runs the same number of model chunks, so each row has a fixed
+    length and a single all_gather_into_tensor replaces the pickling object gather.
+    The last column flags the rank that runs the scheduler. A None mem_limit
+    travels as NaN and comes back as None.
+    """
+    num_chunks = len(f)
+    local = torch.tensor(
+        [*f, *b, *w, *f_mem, *b_mem, *w_mem,
+         float('nan') if mem_limit is None else mem_limit,
+         float(is_second_last_pipeline_stage())],
+        dtype=torch.float64,
+        device=torch.cuda.current_device(),
+    )
+    gathered = torch.empty(
+        torch.distributed.get_world_size() * local.numel(),
+        dtype=local.dtype,
+        device=local.device,
+    )
+    torch.distributed.all_gather_into_tensor(gathered, local)
+    rows = gathered.view(torch.distributed.get_world_size(), -1).tolist()
+    columns = tuple(
+        tuple(row[i * num_chunks:(i + 1) * num_chunks] for row in rows) for i in range(6)
+    )
+    mem_limit = tuple(None if math.isnan(row[6 * num_chunks]) else row[6 * num_chunks] for row in rows)
+    src = [i for i, row in enumerate(rows) if row[-1]]
+    assert len(src) == 1
+    return (*columns, mem_limit), src[0]
+
+
+def _broadcast_schedule(schedule, src):
+    """Broadcasts the pickled schedule from ``src`` as a length header plus a uint8 payload."""
+    device = torch.cuda.current_device()
+    if torch.distributed.get_rank() == src:
+        payload = torch.frombuffer(bytearray(pickle.dumps(schedule)), dtype=torch.uint8).to(device)
+        length = torch.tensor([payload.numel()], dtype=torch.int64, device=device)
+    else:
+        length = torch.empty(1, dtype=torch.int64, device=device)
+    torch.distributed.broadcast(length, src)
+    if torch.distributed.get_rank() != src:
+        payload = torch.empty(length.item(), dtype=torch.uint8, device=device)
+    torch.distributed.broadcast(payload, src)
+    if torch.distributed.get_rank() == src:
+        return schedule
+    return pickle.loads(payload.cpu().numpy().tobytes())
+
+
 def update_schedule(scheduler, f: List[int], b: List[int], w: List[int],
                     c: int, f_mem: List[int], b_mem: List[int], w_mem: List[int],
-                    mem_limit: int):
+                    mem_limit: Optional[int]):
     pipeline_model_parallel_size = parallel_state.get_pipeline_model_parallel_world_size()
-    ag_arguments = [None] * torch.distributed.get_world_size()
-    torch.distributed.all_gather_object(ag_arguments, (f, b, w, f_mem, b_mem, w_mem, mem_limit))
-    assert len(ag_arguments) == torch.distributed.get_world_size()
     # Each value is an array of dimension (device, chunk)
-    f, b, w, f_mem, b_mem, w_mem, mem_limit = zip(*ag_arguments)
+    (f, b, w, f_mem, b_mem, w_mem, mem_limit), src = _gather_schedule_arguments(
+        f, b, w, f_mem, b_mem, w_mem, mem_limit)
 
-    if is_second_last_pipeline_stage():
+    global schedule_cache
+    if torch.distributed.get_rank() == src:
         print(
             f"rank {torch.distributed.get_rank()} Performing ILP with: f={f},\n b={b},\n w={w},\n c={c},\n f_mem={f_mem},\n b_mem={b_mem},\n w_mem={w_mem},\n mem_limit={mem_limit}")
-        global schedule_cache
         schedule_cache = scheduler(
             pipeline_model_parallel_size,
             get_num_microbatches(),
@@ -1313,23 +1456,29 @@ def update_schedule(scheduler, f: List[int], b: List[int], w: List[int],
             f_mem, b_mem, w_mem,
             mem_limit,
         )
-        ag_result = [None] * torch.distributed.get_world_size()
-        torch.distributed.all_gather_object(ag_result, schedule_cache)
-
-    else:
-        ag_result = [None] * torch.distributed.get_world_size()
-        torch.distributed.all_gather_object(ag_result, None)
-        schedule_cache = list(filter(lambda x: x is not None, ag_result))
-        assert len(schedule_cache) == 1
-        schedule_cache = schedule_cache[0]
+    schedule_cache = _broadcast_schedule(schedule_cache, src)
     return schedule_cache
 
 
+_zero_bubble_func_factory = None
+
+
 def get_zero_bubble_forward_backward_func():
+    # The scheduler selection only depends on the launch arguments, so it is resolved once.
+    # The returned factory still checks the profiling state on every call.
+    global _zero_bubble_func_factory
+    if _zero_bubble_func_factory is None:
+        _zero_bubble_func_factory = _build_zero_bubble_func_factory()
+    return _zero_bubble_func_factory()
+
+
+def _build_zero_bubble_func_factory():
     pipeline_model_parallel_size = parallel_state.get_pipeline_model_parallel_world_size()
     assert pipeline_model_parallel_size > 1, "zero bubble must be enabled with pipeline parallelism"
 
     args = get_args()
+    vpp_size = parallel_state.get_virtual_pipeline_model_parallel_world_size()
+    pipeline_rank = parallel_state.get_pipeline_model_parallel_rank()
     hidden_size = args.hidden_size
     num_attention_heads = args.num_attention_heads
     seq_length = args.seq_length
@@ -1357,19 +1506,19 @@ def get_zero_bubble_forward_backward_func():
 
             def estimate_free_memory_on_this_rank(old_schedule):
                 (memory_free, memory_all) = [x // 1000000 for x in torch.cuda.mem_get_info()]
-                memory_all = memory_all * get_args().zero_bubble_adaptive_memory_limit_percentile / 100
+                memory_all = memory_all * args.zero_bubble_adaptive_memory_limit_percentile / 100
                 activation_cost = 0
                 stage = parallel_state.get_pipeline_model_parallel_rank()
                 max_activation = 0
                 for node in old_schedule[stage]:
                     chunk = node.chunk if hasattr(node, 'chunk') else 0
-                    if node.type == F:
+                    if node.type is F:
                         activation_cost += conclusion[4][chunk]
-                    elif node.type == B:
+                    elif node.type is B:
                         activation_cost += conclusion[5][chunk]
-                    elif node.type == W:
+                    elif node.type is W:
                         activation_cost += conclusion[6][chunk]
-                    elif node.type == BW:
+                    elif node.type is BW:
                         activation_cost += conclusion[5][chunk]
                         activation_cost += conclusion[6][chunk]
                     max_activation = max(activation_cost, max_activation)
@@ -1384,16 +1533,18 @@ def get_zero_bubble_forward_backward_func():
                 print(f'rank {torch.distributed.get_rank()} mem summary {torch.cuda.memory_summary()}')
                 return free_mem
 
+            # Without memory tracking the profiled activation sizes are all zero.
+            mem_limit = estimate_free_memory_on_this_rank(schedule_cache) if ScheduleTimers.track_mem else None
             schedule_cache = update_schedule(scheduler,
                                              *conclusion,
-                                             mem_limit=estimate_free_memory_on_this_rank(schedule_cache))
+                                             mem_limit=mem_limit)
             is_auto_schedule = True
 
         def wrap_schedule(**kwargs):
             # print(f"DEBUG wrap_schedule data_iterator {kwargs.get('data_iterator')}")
             # assert kwargs.get('data_iterator') is not None, "data_iterator found none in wrap_schedule"
             return func(
-                schedule=schedule_cache[parallel_state.get_pipeline_model_parallel_rank()], **kwargs
+                schedule=schedule_cache[pipeline_rank], **kwargs
             )
 
         return wrap_schedule
@@ -1402,7 +1553,10 @@ def get_zero_bubble_forward_backward_func():
         a = [sum(x) / len(x) for x in a]
         return max(sorted(a)[len(a) // 2], 1)
 
-    if get_args().num_seq_splits > 1:
+    if args.num_seq_splits > 1:
+        # The seq1f1b and V schedulers ignore the profiled memory, don't sample it.
+        ScheduleTimers.track_mem = False
+
         def scheduler(nstages, nmb, f, b, w, c, f_mem, b_mem, w_mem, mem_limit):
             f_mid = avg_then_mid(f)
             b_mid = avg_then_mid(b)
@@ -1421,10 +1575,11 @@ def get_zero_bubble_forward_backward_func():
             return ret
 
         global_zb_runtime = get_zb_runtime_instance()
-        forward_backward_func = wrapped_auto_schedule_forward_backward_func(global_zb_runtime, scheduler=scheduler)
+        forward_backward_func = functools.partial(
+            wrapped_auto_schedule_forward_backward_func, global_zb_runtime, scheduler=scheduler)
         return forward_backward_func
 
-    if get_args().enable_1f1b_v:
+    if args.enable_1f1b_v:
         def scheduler(nstages, nmb, f, b, w, c, f_mem, b_mem, w_mem, mem_limit):
             f_mid = avg_then_mid(f)
             b_mid = avg_then_mid(b)
@@ -1442,13 +1597,13 @@ def get_zero_bubble_forward_backward_func():
             return ret
 
         global_zb_runtime = get_zb_runtime_instance()
-        forward_backward_func = wrapped_auto_schedule_forward_backward_func(global_zb_runtime, scheduler=scheduler)
+        forward_backward_func = functools.partial(
+            wrapped_auto_schedule_forward_backward_func, global_zb_runtime, scheduler=scheduler)
         return forward_backward_func
 
     # Interleaved pipeline
-    if not get_args().zero_bubble_v_schedule and not get_args().enable_zero_bubble \
-            and parallel_state.get_virtual_pipeline_model_parallel_world_size() is not None \
-            and parallel_state.get_virtual_pipeline_model_parallel_world_size() > 1:
+    if not args.zero_bubble_v_schedule and not args.enable_zero_bubble \
+            and vpp_size is not None and vpp_size > 1:
         def scheduler(nstages, nmb, f, b, w, c, f_mem, b_mem, w_mem, mem_limit):
             f_mid = avg_then_mid(f)
             b_mid = avg_then_mid(b)
@@ -1459,29 +1614,30 @@ def get_zero_bubble_forward_backward_func():
                 w=w_mid,
                 n_stages=nstages,
                 n_micro=nmb,
-                max_chunks=parallel_state.get_virtual_pipeline_model_parallel_world_size(),
+                max_chunks=vpp_size,
             )
             print(f"using interleaved 1f1b")
             # TODO: support origin interleaved 1f1b
             # local_order = vpp.create_schedule(config)
             local_order = group_interleaved_1f1b.create_schedule(
                 config,
-                cpu_offload=get_args().cpu_offload,
-                recompute_granularity=get_args().recompute_granularity,
-                recompute_method=get_args().recompute_method,
-                recompute_num_layers=get_args().recompute_num_layers,
-                interleave_group_size=get_args().interleave_group_size,
-                offload_chunk_num=get_args().offload_chunk_num,
+                cpu_offload=args.cpu_offload,
+                recompute_granularity=args.recompute_granularity,
+                recompute_method=args.recompute_method,
+                recompute_num_layers=args.recompute_num_layers,
+                interleave_group_size=args.interleave_group_size,
+                offload_chunk_num=args.offload_chunk_num,
             )
-            offload_time = get_args().offload_time if get_args().cpu_offload else None
+            offload_time = args.offload_time if args.cpu_offload else None
             ret = run_schedule_passes(config, local_order, offload_time=offload_time)
             return ret
 
         global_zb_runtime = get_zb_runtime_instance()
-        forward_backward_func = wrapped_auto_schedule_forward_backward_func(global_zb_runtime, scheduler=scheduler)
+        forward_backward_func = functools.partial(
+            wrapped_auto_schedule_forward_backward_func, global_zb_runtime, scheduler=scheduler)
         return forward_backward_func
 
-    if not get_args().enable_zero_bubble and not get_args().zero_bubble_v_schedule:
+    if not args.enable_zero_bubble and not args.zero_bubble_v_schedule:
         def scheduler(nstages, nmb, f, b, w, c, f_mem, b_mem, w_mem, mem_limit):
             f_mid = avg_then_mid(f)
             b_mid = avg_then_mid(b)
@@ -1500,16 +1656,19 @@ def get_zero_bubble_forward_backward_func():
             return ret
 
         global_zb_runtime = get_zb_runtime_instance()
-        forward_backward_func = wrapped_auto_schedule_forward_backward_func(global_zb_runtime, scheduler=scheduler)
+        forward_backward_func = functools.partial(
+            wrapped_auto_schedule_forward_backward_func, global_zb_runtime, scheduler=scheduler)
         return forward_backward_func
 
-    if parallel_state.get_virtual_pipeline_model_parallel_world_size() is not None:
+    if vpp_size is not None:
+        ScheduleTimers.track_mem = False
+
         def scheduler(nstages, nmb, f, b, w, c, _f_mem, _b_mem, _w_mem, _mem_limit):
             # For V schedule, we take average on each stage and then use mid value cross each stage.
             f_mid = avg_then_mid(f)
             b_mid = avg_then_mid(b)
             w_mid = avg_then_mid(w)
-            if get_args().zero_bubble_v_schedule_mem_setup != 'zb':
+            if args.zero_bubble_v_schedule_mem_setup != 'zb':
                 config = zb.GraphConfig(
                     cost_f=[1000.0 for _ in range(nstages)],
                     cost_b=[1000.0 for _ in range(nstages)],
@@ -1526,12 +1685,12 @@ def get_zero_bubble_forward_backward_func():
                 )
                 # Use fixed schedule for now
                 pp_graph = zbv_greedy.PipelineGraph(
-                    nstages, nmb, get_args().zero_bubble_v_schedule_mem_setup, int(1000), int(1000), int(1000), int(1)
+                    nstages, nmb, args.zero_bubble_v_schedule_mem_setup, int(1000), int(1000), int(1000), int(1)
                 )
                 local_order = pp_graph.create_schedule(config)
                 ret = run_schedule_passes(
                     config, local_order,
-                    post_validation=get_args().enable_optimizer_post_validation)
+                    post_validation=args.enable_optimizer_post_validation)
                 return ret
             config = zb.GraphConfig(
                 cost_f=[float(f_mid) for _ in range(nstages)],
@@ -1559,14 +1718,14 @@ def get_zero_bubble_forward_backward_func():
             local_order = pp_graph.create_schedule(config)
             ret = run_schedule_passes(
                 config, local_order,
-                post_validation=get_args().enable_optimizer_post_validation,
+                post_validation=args.enable_optimizer_post_validation,
                 validate=False)
             return ret
 
-        if get_args().zero_bubble_v_schedule:
+        if args.zero_bubble_v_schedule:
             global_zb_runtime = get_zb_runtime_instance()
-            forward_backward_func = wrapped_auto_schedule_forward_backward_func(global_zb_runtime,
-                                                                                scheduler=scheduler)
+            forward_backward_func = functools.partial(
+                wrapped_auto_schedule_forward_backward_func, global_zb_runtime, scheduler=scheduler)
             # forward_backward_func = wrapped_auto_schedule_forward_backward_func(forward_backward_pipelining_with_interleaving_auto_schedule,
             #                                                                     scheduler=scheduler)
         else:
@@ -1605,11 +1764,12 @@ def get_zero_bubble_forward_backward_func():
             )
             local_order = zb.create_schedule(config)
             ret = run_schedule_passes(config, local_order,
-                                      post_validation=get_args().enable_optimizer_post_validation,
+                                      post_validation=args.enable_optimizer_post_validation,
                                       validate=False)
             return ret
 
         global_zb_runtime = get_zb_runtime_instance()
-        forward_backward_func = wrapped_auto_schedule_forward_backward_func(global_zb_runtime, scheduler=scheduler)
+        forward_backward_func = functools.partial(
+            wrapped_auto_schedule_forward_backward_func, global_zb_runtime, scheduler=scheduler)
 
     return forward_backward_func
@@ -1,4 +1,5 @@
-from dataclasses import dataclass
+import functools
+from dataclasses import dataclass, field
 from enum import Enum
 from typing import List, Optional
 
@@ -30,67 +31,86 @@ class FuncType(Enum):
         return self.value
 
     def is_offload(self):
-        return self in {FuncType.OFFLOAD_BARRIER, FuncType.OFFLOAD_SEND_START, FuncType.OFFLOAD_SEND_END,
-                        FuncType.OFFLOAD_RECV_PREP, FuncType.OFFLOAD_RECV_START, FuncType.OFFLOAD_RECV_END}
+        return self in _OFFLOAD_TYPES
 
     def has_offload_barrier(self):
-        return self in {
-            FuncType.OFFLOAD_BARRIER,
-            FuncType.OFFLOAD_SEND_START,
-            FuncType.OFFLOAD_RECV_START,
-        }
+        return self in _OFFLOAD_BARRIER_TYPES
 
     def is_computation(self):
-        return self in {F, B, W, BW, R}
+        return self in _COMPUTATION_TYPES
 
     def is_communication(self):
-        return self in {
-            FuncType.SEND_FORWARD,
-            FuncType.RECV_FORWARD,
-            FuncType.SEND_BACKWARD,
-            FuncType.RECV_BACKWARD,
-            FuncType.POST_VALIDATION,
-            FuncType.SEND_POST_VALIDATION,
-            FuncType.RECV_POST_VALIDATION,
-        }
+        return self in _COMMUNICATION_TYPES
 
     def is_send(self):
-        return self in {
-            FuncType.SEND_FORWARD,
-            FuncType.SEND_BACKWARD,
-            FuncType.SEND_POST_VALIDATION,
-        }
+        return self in _SEND_TYPES
 
     def is_recv(self):
-        return self in {
-            FuncType.RECV_FORWARD,
-            FuncType.RECV_BACKWARD,
-            FuncType.RECV_POST_VALIDATION,
-        }
+        return self in _RECV_TYPES
 
     def peer_type(self):
-        pairs = [
-            (FuncType.SEND_FORWARD, FuncType.RECV_FORWARD),
-            (FuncType.SEND_BACKWARD, FuncType.RECV_BACKWARD),
-            (FuncType.SEND_POST_VALIDATION, FuncType.RECV_POST_VALIDATION),
-        ]
-        m = {k: v for k, v in pairs}
-        m.update({v: k for k, v in pairs})
-        return m[self]
+        return _PEER_TYPES[self]
 
     def is_backward_comm(self):
-        return self in {
-            FuncType.SEND_BACKWARD,
-            FuncType.RECV_BACKWARD,
-        }
+        return self in _BACKWARD_COMM_TYPES
 
     def is_post_validation_related(self):
-        return self in (
-            FuncType.POST_VALIDATION,
-            FuncType.SEND_POST_VALIDATION,
-            FuncType.RECV_POST_VALIDATION,
-        )
-
+        return self in _POST_VALIDATION_TYPES
+
+
+# The predicates above are called for every node on the schedule passes, build their sets once.
+_OFFLOAD_TYPES = frozenset({
+    FuncType.OFFLOAD_BARRIER,
+    FuncType.OFFLOAD_SEND_START,
+    FuncType.OFFLOAD_SEND_END,
+    FuncType.OFFLOAD_RECV_PREP,
+    FuncType.OFFLOAD_RECV_START,
+    FuncType.OFFLOAD_RECV_END,
+})
+_OFFLOAD_BARRIER_TYPES = frozenset({
+    FuncType.OFFLOAD_BARRIER,
+    FuncType.OFFLOAD_SEND_START,
+    FuncType.OFFLOAD_RECV_START,
+})
+_COMPUTATION_TYPES = frozenset({FuncType.F, FuncType.B, FuncType.W, FuncType.BW, FuncType.R})
+_COMMUNICATION_TYPES = frozenset({
+    FuncType.SEND_FORWARD,
+    FuncType.RECV_FORWARD,
+    FuncType.SEND_BACKWARD,
+    FuncType.RECV_BACKWARD,
+    FuncType.POST_VALIDATION,
+    FuncType.SEND_POST_VALIDATION,
+    FuncType.RECV_POST_VALIDATION,
+})
+_SEND_TYPES = frozenset({
+    FuncType.SEND_FORWARD,
+    FuncType.SEND_BACKWARD,
+    FuncType.SEND_POST_VALIDATION,
+})
+_RECV_TYPES = frozenset({
+    FuncType.RECV_FORWARD,
+    FuncType.RECV_BACKWARD,
+    FuncType.RECV_POST_VALIDATION,
+})
+_BACKWARD_COMM_TYPES = frozenset({
+    FuncType.SEND_BACKWARD,
+    FuncType.RECV_BACKWARD,
+})
+_POST_VALIDATION_TYPES = frozenset({
+    FuncType.POST_VALIDATION,
+    FuncType.SEND_POST_VALIDATION,
+    FuncType.RECV_POST_VALIDATION,
+})
+_PEER_TYPES = {}
+for _send, _recv in [
+    (FuncType.SEND_FORWARD, FuncType.RECV_FORWARD),
+    (FuncType.SEND_BACKWARD, FuncType.RECV_BACKWARD),
+    (FuncType.SEND_POST_VALIDATION, FuncType.RECV_POST_VALIDATION),
+]:
+    _PEER_TYPES[_send] = _recv
+    _PEER_TYPES[_recv] = _send
+del _send, _recv
+_FUNC_TYPE_INDEX = {t: i for i, t in enumerate(FuncType)}
 
 F = FuncType.F
 B = FuncType.B
@@ -111,11 +131,17 @@ class NodeKey:
     microbatch: int
     seq_split_idx: int
 
+    _hash: int = field(init=False, repr=False, compare=False)
+
     def __post_init__(self):
         assert isinstance(self.type, FuncType)
+        # Keys are looked up in dicts throughout the passes, so the hash is computed once.
+        # It uses the type's index as enum hashes are seeded per process and schedules get pickled.
+        object.__setattr__(self, '_hash', hash(
+            (_FUNC_TYPE_INDEX[self.type], self.layer_group_idx, self.microbatch, self.seq_split_idx)))
 
     def __hash__(self):
-        return hash((self.type, self.layer_group_idx, self.microbatch, self.seq_split_idx))
+        return self._hash
 
 
 @dataclass(eq=True)
@@ -140,15 +166,18 @@ class ScheduledNode:
     rollback: bool = False
     need_recompute: bool = False
     should_offload: bool = False
+    # Key fields are never mutated after construction, so the key is built once.
+    _key: NodeKey = field(init=False, repr=False, compare=False)
 
     def __post_init__(self):
         assert isinstance(self.type, FuncType)
+        self._key = NodeKey(self.type, self.layer_group_idx, self.microbatch, self.seq_split_idx)
 
     def __hash__(self):
-        return hash(self.get_key())
+        return hash(self._key)
 
     def get_key(self):
-        return NodeKey(self.type, self.layer_group_idx, self.microbatch, self.seq_split_idx)
+        return self._key
 
     def get_prev_key(self, n_layer_groups: int):
         assert self.layer_group_idx is not None
@@ -171,6 +200,11 @@ class ScheduledNode:
     def get_activation_key(self):
         return self.microbatch, self.chunk, self.seq_split_idx
 
+    @functools.cached_property
+    def nvtx_tag(self):
+        """Label for profiling ranges, built on first use once the schedule is final."""
+        return f'{self.type}.{self.microbatch}.{self.chunk}.{self.seq_split_idx}'
+
 
 @dataclass
 class GraphConfig:
@@ -205,19 +239,21 @@ class GraphConfig:
         )
 
     def __post_init__(self):
-        assert all([isinstance(cost_f, float) for cost_f in self.cost_f])
-        assert all([isinstance(cost_b, float) for cost_b in self.cost_b])
-        assert all([isinstance(cost_w, float) for cost_w in self.cost_w])
+        assert all(isinstance(cost_f, float) for cost_f in self.cost_f)
+        assert all(isinstance(cost_b, float) for cost_b in self.cost_b)
+        assert all(isinstance(cost_w, float) for cost_w in self.cost_w)
         assert isinstance(self.cost_comm, float)
-        assert all([f + b + w == 0 for (f, b, w) in zip(self.mem_f, self.mem_b, self.mem_w)])
+        assert all(f + b + w == 0 for (f, b, w) in zip(self.mem_f, self.mem_b, self.mem_w))
         assert self.n_stages is not None
         assert self.n_micro is not None
 
     def get_cost(self, stage: int, func_type: FuncType):
-        if func_type == BW:
+        if func_type is F:
+            return self.cost_f[stage]
+        if func_type is B:
+            return self.cost_b[stage]
+        if func_type is W:
+            return self.cost_w[stage]
+        if func_type is BW:
             return self.cost_b[stage] + self.cost_w[stage]
-        return {
-            F: self.cost_f,
-            B: self.cost_b,
-            W: self.cost_w,
-        }[func_type][stage]
+        raise KeyError(func_type)
@@ -5,6 +5,8 @@ class ScheduleTimers:
     iter_counter = 0
     comm_time = 0
     concluded = False
+    # Whether f/b memory deltas are sampled, only needed when the scheduler consumes them.
+    track_mem = True
 
     chunks = []
 
@@ -71,7 +71,9 @@ class VocabParallelCrossEntropy:
     ) -> Tuple[torch.Tensor, torch.Tensor]:
 
         # Loss = log(sum(exp(logits))) - predicted-logit.
-        loss = torch.log(sum_exp_logits) - predicted_logits
+        # Subtract in place into the log result to skip a temporary, sum_exp_logits is still
+        # needed below so it cannot be overwritten.
+        loss = torch.log(sum_exp_logits).sub_(predicted_logits)
 
         # Normalize and optionally smooth logits
         exp_logits.div_(sum_exp_logits.unsqueeze(dim=-1))
@@ -2,6 +2,7 @@ import functools
 import logging
 import os
 import queue
+from collections import deque
 from contextlib import contextmanager
 
 from megatron.training import get_args, get_timers
@@ -124,6 +125,10 @@ def validate_arguments(args):
         assert not args.enable_zero_bubble, "cannot enable zero bubble for 1f1b-v"
         assert not args.enable_optimizer_post_validation, "cannot enable post validation for 1f1b-v"
 
+    assert args.offload_prefetch_depth >= 1, "offload prefetch depth counts the store being resumed, so it must be at least 1"
+    if args.offload_prefetch_depth > 1:
+        assert not args.paired_barrier, "offload prefetch changes the resume order the paired barrier relies on"
+
     if args.enable_zero_bubble:
         if args.use_distributed_optimizer:
             assert not args.overlap_param_gather, "the original code somehow doesn't work"
@@ -151,8 +156,8 @@ class WeightGradStore:
             return
         # Lazy init to make sure parallel_state and get_args() have been initialized.
         num_chunks = parallel_state.get_virtual_pipeline_model_parallel_world_size() or 1
-        # chunk id => seq id => Queue
-        cls.weight_grad_queue = [[queue.Queue() for _ in range(get_args().num_seq_splits)] for _ in range(num_chunks)]
+        # chunk id => seq id => deque, only touched by the training thread so no locking is needed.
+        cls.weight_grad_queue = [[deque() for _ in range(get_args().num_seq_splits)] for _ in range(num_chunks)]
 
     @classmethod
     def is_supported(cls):
@@ -206,7 +211,7 @@ class WeightGradStore:
     @classmethod
     def queue_size(cls, chunk=0, seq_split_idx=0):
         cls.lazy_init()
-        return WeightGradStore.weight_grad_queue[chunk][seq_split_idx].qsize()
+        return len(WeightGradStore.weight_grad_queue[chunk][seq_split_idx])
 
     @classmethod
     def flush(cls, chunk=0, seq_split_idx=0):
@@ -215,14 +220,14 @@ class WeightGradStore:
         if not cls.split_bw():
             assert len(cls.cache) == 0
             return
-        cls.weight_grad_queue[chunk][seq_split_idx].put(cls.cache)
+        cls.weight_grad_queue[chunk][seq_split_idx].append(cls.cache)
         cls.cache = []
 
     @classmethod
     def pop(cls, chunk=0, seq_split_idx=0):
         cls.lazy_init()
-        if cls.weight_grad_queue[chunk][seq_split_idx].qsize() > 0:
-            stored_grads = cls.weight_grad_queue[chunk][seq_split_idx].get()
+        if cls.weight_grad_queue[chunk][seq_split_idx]:
+            stored_grads = cls.weight_grad_queue[chunk][seq_split_idx].popleft()
             for weight, pre_func, func in stored_grads:
                 func(*pre_func(async_op=False))
         else:
@@ -237,21 +242,12 @@ class WeightGradStore:
             return
         for chunk, chunk_q in enumerate(cls.weight_grad_queue):
             for seq, seq_q in enumerate(chunk_q):
-                assert seq_q.empty(), f"Queue is not empty chunk {chunk} seq {seq} rank {rank}. len {seq_q.qsize()}"
+                assert not seq_q, f"Queue is not empty chunk {chunk} seq {seq} rank {rank}. len {len(seq_q)}"
 
     @classmethod
     def clear(cls, model, chunk=0, seq_split_idx=0):
         cls.lazy_init()
-        weight_grad_tasks = []
-        while cls.weight_grad_queue[chunk][seq_split_idx].qsize() > 0:
-            stored_grads = cls.weight_grad_queue[chunk][seq_split_idx].get()
-            if len(weight_grad_tasks) == 0:
-                for _ in stored_grads:
-                    weight_grad_tasks.append([])
-            else:
-                assert len(weight_grad_tasks) == len(stored_grads)
-            for i, task in enumerate(stored_grads):
-                weight_grad_tasks[i].append(task)
+        weight_grad_queue = cls.weight_grad_queue[chunk][seq_split_idx]
         # timers = get_timers()
         # weight_params = []
         # handles = []
@@ -264,21 +260,22 @@ class WeightGradStore:
         # embedding_handles = _allreduce_embedding_grads([model], config, async_op=True)
         # handles += embedding_handles
 
-        for i in range(len(weight_grad_tasks)):
-            tasks = weight_grad_tasks[i]
-            param = None
-            for j in range(len(tasks)):
-                weight, pre_func, func = tasks[j]
-                if param is None:
-                    param = weight
+        # Every flush stores the same weights in the same order, run each one as it is popped.
+        params = None
+        while weight_grad_queue:
+            stored_grads = weight_grad_queue.popleft()
+            if params is None:
+                params = [weight for weight, _, _ in stored_grads]
+            else:
+                assert len(params) == len(stored_grads)
+            for param, (weight, pre_func, func) in zip(params, stored_grads):
                 assert param.storage().data_ptr() == weight.storage().data_ptr()
                 func(*pre_func(async_op=False))
-                tasks[j] = None  # release memory
-            # weight_params.append(param)
-            # if get_args().overlap_grad_reduce:
-            #     # All-reduce param grad here
-            #     handles += model.async_reduce_grad(param)
-            weight_grad_tasks[i] = None  # release memory
+        # weight_params = params
+        # if get_args().overlap_grad_reduce:
+        #     # All-reduce param grad here
+        #     for param in weight_params:
+        #         handles += model.async_reduce_grad(param)
 
         # timers('wait_all_reduce', log_level=1).start(barrier=False)
         # for handle in handles:
@@ -37,7 +37,10 @@ try:
 except ImportError:
     rearrange = None
 
-from flash_attn.flash_attn_interface import _flash_attn_varlen_forward, _flash_attn_varlen_backward
+try:
+    from flash_attn.flash_attn_interface import _flash_attn_varlen_forward, _flash_attn_varlen_backward
+except ImportError:
+    _flash_attn_varlen_forward = _flash_attn_varlen_backward = None
 try:
     from flash_attn.flash_attn_interface import flash_attn_unpadded_func
 except ImportError:
@@ -1119,6 +1119,18 @@ def _add_training_args(parser):
     group.add_argument('--no-paired-barrier', action='store_false', help='Disable paired barrier for offload.', dest='paired_barrier')
     group.add_argument('--measure-activation-memory', action='store_true', help='Measure activation memory.')
     group.add_argument('--offload-continuous-buffers', action='store_true', help='Use continuous buffers in offload.')
+    group.add_argument('--offload-persistent-gpu-buffers', action='store_true',
+                       help='Keep GPU resume bins allocated in each offload store pool and lend them to '
+                       'stores from prepare_resume to resume_release, instead of reallocating them in every '
+                       'prepare_resume. Avoids caching-allocator churn at the cost of keeping one set of bins '
+                       'reserved per store being resumed at the same time.')
+    group.add_argument('--offload-prefetch-depth', type=int, default=1,
+                       help='Number of prepared offload stores to start resuming (H2D) when the schedule '
+                       'resumes one. 1 disables prefetching. Requires --no-paired-barrier when larger than 1.')
+    group.add_argument('--offload-max-inflight-copies', type=int, default=None,
+                       help='Maximum number of outstanding D2H copies during offload. Unbounded if not set. '
+                       'When the limit is reached the host blocks until the oldest copy finishes, '
+                       'which also stalls issuing compute from the schedule thread.')
     # deprecated
     group.add_argument('--checkpoint-activations', action='store_true',
                        help='Checkpoint activation to allow for training '
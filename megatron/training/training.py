@@ -159,8 +159,9 @@ def setup_gpu_affinity():
         raise RuntimeError("env var RANK is not set. Probably not run by torchrun.")
     rank = int(os.environ["RANK"])
     local_rank = rank % torch.cuda.device_count()
-    if os.environ.get('CUDA_VISIBLE_DEVICES') is not None:
-        gpu_id = int(os.environ.get('CUDA_VISIBLE_DEVICES').split(',')[local_rank])
+    visible_devices = gpu_affinity.get_visible_devices()
+    if visible_devices is not None:
+        gpu_id = int(visible_devices[local_rank])
     else:
         gpu_id = local_rank
 
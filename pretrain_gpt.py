@@ -172,7 +172,7 @@ def loss_func(loss_mask: torch.Tensor, output_tensor: torch.Tensor):
     reporting_loss = loss.clone().detach()
     torch.distributed.all_reduce(reporting_loss, group=mpu.get_data_parallel_group())
 
-    local_num_tokens = loss[1].clone().detach().to(torch.int)
+    local_num_tokens = loss[1].detach().to(torch.int)
     return (
         loss[0] * args.context_parallel_size,
         local_num_tokens,
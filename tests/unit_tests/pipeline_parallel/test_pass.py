@@ -1,15 +1,20 @@
 import copy
+import dataclasses
+import pickle
+from types import SimpleNamespace
 from typing import List
 
+import numpy as np
 import pytest
 
+from megatron.core.pipeline_parallel.offload import ActivationStore, ActivationStorePool
 from megatron.core.pipeline_parallel.zerobubble.scheduler import basic1f1b, vpp, v1f1b, zb, zbv, group_interleaved_1f1b, \
     zbv_greedy
 from megatron.core.pipeline_parallel.zerobubble.scheduler.communication import validate_communication, \
     CommSet, add_communication_nodes, reorder_communication, \
     add_communication_nodes_without_sorting, add_post_validation_nodes, tag_rollback_communication
 from megatron.core.pipeline_parallel.zerobubble.scheduler.graph import GraphConfig, ScheduledNode
-from megatron.core.pipeline_parallel.zerobubble.scheduler.offloading import add_offload, smooth_start_time
+from megatron.core.pipeline_parallel.zerobubble.scheduler.offloading import add_offload
 from megatron.core.pipeline_parallel.zerobubble.scheduler.passes import pre_validate, add_send_recv_peer_stage, \
     add_time, print_schedule
 
@@ -26,7 +31,6 @@ def old_run_passes(
     local_order = add_time(config, local_order)
     if offload_time:
         local_order = add_offload(config, local_order, offload_time)
-        local_order = smooth_start_time(local_order)
     local_order = old_run_communication_passes(config, local_order, post_validation)
     print_schedule(local_order)
     if validate:
@@ -308,3 +312,121 @@ def test_new_comm_impl_on_zbv_half(n_stages, n_micro):
     #     for o, n in zip(old_stage_nodes, new_stage_nodes):
     #         assert o.get_key() == n.get_key(), f"stage {stage} old {o.type} {o.microbatch} new {n.type} {n.microbatch}"
     #     stage += 1
+
+
+def old_ffd_pack(sizes, bin_size, min_bin):
+    def nearest_power_of_2(x):
+        return 2**(x-1).bit_length()
+
+    bin_size = list(bin_size)
+    current_bin = [0] * len(bin_size)
+    solution = []
+    for size in sizes:
+        for i in range(len(bin_size)):
+            if current_bin[i] + size <= bin_size[i]:
+                break
+        else:
+            bin_size.append(max(nearest_power_of_2(size), min_bin))
+            current_bin.append(0)
+            i = len(bin_size) - 1
+        solution.append((i, current_bin[i]))
+        current_bin[i] += size
+    return solution, current_bin
+
+
+@pytest.mark.parametrize("seed", range(8))
+def test_ffd_pack_matches_python_loop(seed):
+    from megatron.core.pipeline_parallel.offload import _ffd_pack
+
+    rng = np.random.default_rng(seed)
+    sizes = np.sort(rng.integers(1, 1 << 16, size=64) * 64)[::-1].astype(np.int64)
+    max_bin = 2**(int(sizes[0]) - 1).bit_length()
+    min_bin = max_bin >> 7
+    total_size = int(sizes.sum())
+    bin_size = []
+    while sum(bin_size) < total_size:
+        remaining = total_size - sum(bin_size)
+        bin_size.append(max(min(max_bin, 2**(remaining - 1).bit_length()), min_bin))
+
+    bin_idx, offset, used = _ffd_pack(sizes, np.asarray(bin_size, dtype=np.int64), min_bin)
+    solution, current_bin = old_ffd_pack(sizes.tolist(), bin_size, min_bin)
+    assert list(zip(bin_idx.tolist(), offset.tolist())) == solution
+    assert used.tolist() == current_bin
+
+
+@pytest.mark.parametrize("n_stages,n_micro", TEST_SETTINGS)
+def test_dispatch_table_matches_forward_scan(n_stages, n_micro):
+    from megatron.core.pipeline_parallel.zerobubble.runtime import TrainingIteration, \
+        AUTO_SCHEDULE_COMMUNICATION_TYPES
+    from megatron.core.pipeline_parallel.zerobubble.scheduler.graph import W
+
+    config = create_dummy_config(n_stages=n_stages, n_micro=n_micro, max_chunks=2)
+    pp_graph = zbv_greedy.PipelineGraph(config.n_stages, config.n_micro, "min", 1000.0, 1000.0, 1000.0, 10.0)
+    local_order = new_run_passes(config, pp_graph.create_schedule(config), post_validation=True)
+    for schedules in local_order:
+        iteration = SimpleNamespace(
+            iteration_config=SimpleNamespace(schedules=schedules), _DISPATCH=TrainingIteration._DISPATCH,
+            direction_map=TrainingIteration.direction_map)
+        table = TrainingIteration._build_dispatch_table(iteration)
+        assert len(table) == len(schedules)
+        for it, (handler, node, next_is_comm, next_compute, non_w_pending) in enumerate(table):
+            assert node is schedules[it]
+            assert handler is TrainingIteration._DISPATCH[node.type]
+            assert next_is_comm == (
+                it + 1 < len(schedules) and schedules[it + 1].type in AUTO_SCHEDULE_COMMUNICATION_TYPES)
+            later_compute = [x for x in schedules[it + 1:] if x.type.is_computation()]
+            assert next_compute is (later_compute[0] if later_compute else None)
+            assert non_w_pending == any([x.type != W for x in schedules[it + 1:]])
+            if node.type in AUTO_SCHEDULE_COMMUNICATION_TYPES:
+                assert node.direction_key == TrainingIteration.direction_map(node)
+
+
+@pytest.mark.parametrize("n_stages,n_micro", TEST_SETTINGS)
+def test_node_key_survives_pickle_and_replace(n_stages, n_micro):
+    config = create_dummy_config(n_stages=n_stages, n_micro=n_micro)
+    local_order = new_run_passes(config, basic1f1b.create_schedule(config))
+    for node in (node for stage_nodes in local_order for node in stage_nodes):
+        key = node.get_key()
+        for copied in (pickle.loads(pickle.dumps(node)), dataclasses.replace(node)):
+            assert copied == node
+            assert copied.get_key() == key
+            assert hash(copied) == hash(node)
+            assert hash(copied.get_key()) == hash(key)
+        restored_key = pickle.loads(pickle.dumps(key))
+        assert restored_key == key
+        assert hash(restored_key) == hash(key)
+        moved = dataclasses.replace(node, microbatch=node.microbatch + 1)
+        assert moved.get_key() == dataclasses.replace(key, microbatch=key.microbatch + 1)
+        assert moved.get_key() != key
+        assert node.nvtx_tag is node.nvtx_tag
+        assert moved.nvtx_tag != node.nvtx_tag
+
+
+class FakeResumeStore:
+    def __init__(self, resumed):
+        self._state = ActivationStore.State.RESUME_PREPARED
+        self._resumed = resumed
+
+    def resume(self):
+        self._state = ActivationStore.State.RESUMED
+        self._resumed.append(self)
+
+
+@pytest.mark.parametrize("depth", [1, 2, 3])
+def test_offload_prefetch_depth(monkeypatch, depth):
+    import megatron.training
+
+    monkeypatch.setattr(megatron.training, "get_args", lambda: SimpleNamespace(offload_prefetch_depth=depth))
+    resumed = []
+    pool = ActivationStorePool()
+    stores = [FakeResumeStore(resumed) for _ in range(4)]
+    pool._stage_queues[3].extend(stores)
+
+    pool.resume()
+    # The store being resumed plus depth - 1 prepared stores behind it.
+    assert resumed == stores[:depth]
+    assert pool._stage_queues[4] == stores[:1]
+
+    pool.resume()
+    # A store already started by prefetch is not resumed twice.
+    assert resumed == stores[:depth + 1]